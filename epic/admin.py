@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Profile, CoolDown, Server, JoinCode, Guild, Gamble, Hunt
+from .models import Profile, CoolDown, Server, JoinCode, Guild, Gamble, GambleRollup, GambleBucket, Hunt, HuntBucket
 
 
 @admin.register(JoinCode)
@@ -42,6 +42,20 @@ class GambleAdmin(admin.ModelAdmin):
         return str(obj)
 
 
+@admin.register(GambleRollup)
+class GambleRollupAdmin(admin.ModelAdmin):
+    list_display = ["profile", "game", "count", "net", "big_win", "big_loss"]
+    search_fields = ("profile__last_known_nickname", "profile__uid")
+    list_filter = ("game",)
+
+
+@admin.register(GambleBucket)
+class GambleBucketAdmin(admin.ModelAdmin):
+    list_display = ["profile", "resolution", "start", "game", "count", "net"]
+    search_fields = ("profile__last_known_nickname", "profile__uid")
+    list_filter = ("resolution", "game")
+
+
 @admin.register(Hunt)
 class HuntAdmin(admin.ModelAdmin):
     list_display = ["player", "target", "money", "xp", "loot", "created"]
@@ -52,3 +66,10 @@ class HuntAdmin(admin.ModelAdmin):
         if not obj.profile:
             return "Anonymous"
         return obj.profile.last_known_nickname
+
+
+@admin.register(HuntBucket)
+class HuntBucketAdmin(admin.ModelAdmin):
+    list_display = ["profile", "resolution", "start", "target", "loot", "hunted", "xp"]
+    search_fields = ("profile__last_known_nickname", "profile__uid", "target")
+    list_filter = ("resolution",)
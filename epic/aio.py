@@ -0,0 +1,276 @@
+"""
+Native asyncio access for the bot's hottest statements, enabled with `ASYNC_DB=1`.
+Uses aiosqlite for the SQLite deployment and asyncpg otherwise. The Django models
+stay the source of truth for the schema: table and column names come from `_meta`
+and values are prepared with the same field methods the ORM uses.
+"""
+
+import re
+import asyncio
+import datetime
+import itertools
+import contextlib
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import DateTimeField
+from django.core.exceptions import ImproperlyConfigured
+
+from .cache import cooldown_views, stats_cache
+from .db import SQLITE_PRAGMAS
+from .models import CoolDown, Profile, Server, ROLLUPS
+from .scheduler import scheduler
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+qn = connection.ops.quote_name
+placeholder_regex = re.compile(r"%s")
+
+
+class SQLiteBackend:
+    def __init__(self, database):
+        if aiosqlite is None:
+            raise ImproperlyConfigured("ASYNC_DB with SQLite requires the aiosqlite package.")
+        self.database = database
+        self._conn = None
+        # aiosqlite has a single connection, so transactions take turns
+        self._lock = asyncio.Lock()
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        async with self._lock:
+            if self._conn is None:
+                self._conn = await aiosqlite.connect(self.database["NAME"], isolation_level=None)
+                # Django turns these on for its own SQLite connections
+                await self._conn.execute("PRAGMA foreign_keys = ON")
+                if settings.SQLITE_TUNED:
+                    for pragma in SQLITE_PRAGMAS:
+                        await self._conn.execute(pragma)
+            # see epic.backends.sqlite3
+            await self._conn.execute("BEGIN IMMEDIATE" if settings.SQLITE_TUNED else "BEGIN")
+            try:
+                yield self
+            except BaseException:
+                await self._conn.execute("ROLLBACK")
+                raise
+            await self._conn.execute("COMMIT")
+
+    async def execute(self, sql, params=()):
+        """Returns the number of rows changed."""
+        async with self._conn.execute(sql.replace("%s", "?"), params) as cursor:
+            return cursor.rowcount
+
+    async def executemany(self, sql, rows):
+        await self._conn.executemany(sql.replace("%s", "?"), rows)
+
+    async def fetch(self, sql, params=()):
+        async with self._conn.execute(sql.replace("%s", "?"), params) as cursor:
+            return await cursor.fetchall()
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+
+class PostgresBackend:
+    def __init__(self, database):
+        if asyncpg is None:
+            raise ImproperlyConfigured("ASYNC_DB with Postgres requires the asyncpg package.")
+        self.database = database
+        self._pool = None
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        if self._pool is None:
+            self._pool = await asyncpg.create_pool(
+                database=self.database["NAME"],
+                user=self.database["USER"],
+                password=self.database["PASSWORD"],
+                host=self.database["HOST"],
+                port=self.database["PORT"],
+                max_size=settings.DB_WORKERS,
+            )
+        async with self._pool.acquire() as conn, conn.transaction():
+            yield _PostgresConnection(conn)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+class _PostgresConnection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    @staticmethod
+    def _sql(sql):
+        counter = itertools.count(1)
+        return placeholder_regex.sub(lambda _: f"${next(counter)}", sql)
+
+    async def execute(self, sql, params=()):
+        """Returns the number of rows changed."""
+        # the status is e.g. "INSERT 0 1" or "UPDATE 3"
+        status = await self.conn.execute(self._sql(sql), *params)
+        return int(status.rsplit(" ", 1)[-1]) if status[-1:].isdigit() else 0
+
+    async def executemany(self, sql, rows):
+        await self.conn.executemany(self._sql(sql), rows)
+
+    async def fetch(self, sql, params=()):
+        return await self.conn.fetch(self._sql(sql), *params)
+
+
+enabled = settings.ASYNC_DB
+_backend = None
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        database = settings.DATABASES["default"]
+        _backend = SQLiteBackend(database) if settings.USE_SQLITE else PostgresBackend(database)
+    return _backend
+
+
+async def close():
+    if _backend is not None:
+        await _backend.close()
+
+
+def _columns(model_class):
+    return ", ".join(qn(f.column) for f in model_class._meta.concrete_fields)
+
+
+def _from_row(model_class, row):
+    fields = model_class._meta.concrete_fields
+    values = []
+    for field, value in zip(fields, row):
+        value = field.to_python(value)
+        if isinstance(field, DateTimeField) and value is not None and value.tzinfo is None:
+            # SQLite stores naive UTC
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        values.append(value)
+    return model_class.from_db(connection.alias, [f.attname for f in fields], values)
+
+
+def _insert_row(instance):
+    fields = [f for f in instance._meta.concrete_fields if not f.auto_created]
+    return [f.column for f in fields], [f.get_db_prep_save(f.pre_save(instance, add=True), connection) for f in fields]
+
+
+async def get_server(server_id):
+    async with backend().transaction() as tx:
+        rows = await tx.fetch(
+            f"SELECT {_columns(Server)} FROM {qn(Server._meta.db_table)} WHERE {qn('id')} = %s", [server_id]
+        )
+    return _from_row(Server, rows[0]) if rows else None
+
+
+async def get_or_create_profile(uid, defaults):
+    table, select = qn(Profile._meta.db_table), f"SELECT {_columns(Profile)} FROM {qn(Profile._meta.db_table)}"
+    async with backend().transaction() as tx:
+        rows = await tx.fetch(f"{select} WHERE {qn('uid')} = %s", [str(uid)])
+        if rows:
+            return _from_row(Profile, rows[0]), False
+        columns, values = _insert_row(Profile(uid=str(uid), **defaults))
+        # another writer may have created it since the select
+        created = await tx.execute(
+            f"INSERT INTO {table} ({', '.join(map(qn, columns))}) VALUES ({', '.join(['%s'] * len(values))}) "
+            f"ON CONFLICT ({qn('uid')}) DO NOTHING",
+            values,
+        )
+        rows = await tx.fetch(f"{select} WHERE {qn('uid')} = %s", [str(uid)])
+    return _from_row(Profile, rows[0]), created > 0
+
+
+async def sync_cooldowns(updates, evictions):
+    """Same as `epic.query.sync_cooldowns`: one upsert and one delete in a single transaction."""
+    adapt = connection.ops.adapt_datetimefield_value
+    rows = {(cooldown.profile_id, cooldown.type): cooldown.after for cooldown in updates}
+    table = qn(CoolDown._meta.db_table)
+    profile_col, type_col, after_col = (
+        qn(CoolDown._meta.get_field(name).column) for name in ("profile", "type", "after")
+    )
+    async with backend().transaction() as tx:
+        if rows:
+            await tx.executemany(
+                f"INSERT INTO {table} ({profile_col}, {type_col}, {after_col}) VALUES (%s, %s, %s) "
+                f"ON CONFLICT ({profile_col}, {type_col}) DO UPDATE SET {after_col} = excluded.{after_col}",
+                [(profile_id, _type, adapt(after)) for (profile_id, _type), after in rows.items()],
+            )
+        if evictions:
+            await tx.executemany(
+                f"DELETE FROM {table} WHERE {profile_col} = %s AND {type_col} = %s",
+                [(eviction["profile_id"], eviction["type"]) for eviction in evictions],
+            )
+    for (profile_id, _type), after in rows.items():
+        scheduler.schedule(("cooldown", profile_id, _type), after)
+    for eviction in evictions:
+        scheduler.cancel(("cooldown", eviction["profile_id"], eviction["type"]))
+    cooldown_views.discard({profile_id for profile_id, _ in rows} | {e["profile_id"] for e in evictions})
+
+
+def _due_cooldowns_sql():
+    cooldown, profile, server = (qn(m._meta.db_table) for m in (CoolDown, Profile, Server))
+    enabled_types = " OR ".join(
+        f"({cooldown}.{qn('type')} = '{cd_type}' AND {profile}.{qn(cd_type)})"
+        for cd_type, _ in CoolDown.COOLDOWN_TYPE_CHOICES
+        if cd_type != "guild"
+    )
+    return (
+        f"SELECT {cooldown}.{qn('id')}, {cooldown}.{qn('type')}, {profile}.{qn('channel')}, {profile}.{qn('uid')} "
+        f"FROM {cooldown} "
+        f"INNER JOIN {profile} ON {cooldown}.{qn('profile_id')} = {profile}.{qn('uid')} "
+        f"INNER JOIN {server} ON {profile}.{qn('server_id')} = {server}.{qn('id')} "
+        f"WHERE {cooldown}.{qn('after')} <= %s AND {profile}.{qn('notify')} AND {server}.{qn('active')} "
+        f"AND ({enabled_types}) ORDER BY {cooldown}.{qn('after')}"
+    )
+
+
+async def get_cooldown_messages():
+    """Same as `epic.query.get_cooldown_messages`."""
+    # epic.query imports this module
+    from .query import cooldown_message
+
+    now = connection.ops.adapt_datetimefield_value(datetime.datetime.now(tz=datetime.timezone.utc))
+    async with backend().transaction() as tx:
+        rows = await tx.fetch(_due_cooldowns_sql(), [now])
+        if rows:
+            # a cooldown renewed since it was read has a new `after` and must survive
+            await tx.executemany(
+                f"DELETE FROM {qn(CoolDown._meta.db_table)} WHERE {qn('id')} = %s AND {qn('after')} <= %s",
+                [(row[0], now) for row in rows],
+            )
+    cooldown_views.discard({row[3] for row in rows})
+    return [(cooldown_message(uid, cd_type), channel) for _, cd_type, channel, uid in rows]
+
+
+async def insert_events(instances):
+    """Same as `epic.query.insert_events`: append Gamble and Hunt rows and update their rollups in one transaction."""
+    by_model = {}
+    for instance in instances:
+        by_model.setdefault(type(instance), []).append(instance)
+    async with backend().transaction() as tx:
+        for model_class, objs in by_model.items():
+            rows = [_insert_row(obj) for obj in objs]
+            columns = rows[0][0]
+            await tx.executemany(
+                f"INSERT INTO {qn(model_class._meta.db_table)} ({', '.join(map(qn, columns))}) "
+                f"VALUES ({', '.join(['%s'] * len(columns))})",
+                [values for _, values in rows],
+            )
+        for rollup in ROLLUPS:
+            rows = rollup.deltas(by_model.get(rollup.SOURCE, []))
+            if rows:
+                await tx.executemany(rollup.upsert_sql(), rows)
+    stats_cache.discard(instances)
@@ -1,5 +1,17 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
 
 
 class EpicConfig(AppConfig):
     name = "epic"
+
+    def ready(self):
+        from .db import tune_sqlite
+
+        connection_created.connect(tune_sqlite, dispatch_uid="epic.tune_sqlite")
+        if settings.ASYNC_DB:
+            from . import aio
+
+            # fail at startup instead of on the first query when the driver isn't installed
+            aio.backend()
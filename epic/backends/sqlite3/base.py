@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    With SQLITE_TUNED, transactions take the write lock up front with BEGIN IMMEDIATE. A deferred
+    transaction that reads and then writes can't wait for the lock under WAL, it fails straight
+    away with "database is locked" if another connection committed in between.
+    """
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE" if settings.SQLITE_TUNED else "BEGIN")
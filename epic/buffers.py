@@ -0,0 +1,217 @@
+import time
+import logging
+import datetime
+import asyncio
+import threading
+
+from . import aio
+from .models import CoolDown, Hunt
+from .query import sync_cooldowns, insert_events
+from .readiness import readiness
+
+log = logging.getLogger(__name__)
+
+
+class WriteBuffer:
+    """
+    Collects writes in memory and flushes them in the background every
+    `flush_interval` seconds, or as soon as `max_pending` writes are waiting.
+    A batch that fails to write is put back and retried with a backoff.
+    Subclasses implement `_take` (swap out the pending writes), `_restore`
+    (put a failed batch back) and `_write`.
+    """
+
+    flush_interval, max_pending = 0.25, 200
+    # seconds to wait after a failed flush, doubling up to the maximum
+    retry_backoff, max_retry_backoff = 1, 60
+
+    def __init__(self, flush_interval=None, max_pending=None):
+        self.flush_interval = flush_interval or self.flush_interval
+        self.max_pending = max_pending or self.max_pending
+        self._lock = threading.Lock()
+        self._flushing = None
+        self._full = None
+        self.counters = {"flushes": 0, "flushed": 0, "failed": 0}
+        self.flush_latency = {"count": 0, "total": 0.0, "max": 0.0}
+
+    async def run(self):
+        self._full = asyncio.Event()
+        backoff = None
+        while True:
+            if backoff:
+                # a full buffer doesn't cut the backoff short
+                await asyncio.sleep(backoff)
+            else:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+            try:
+                await self.flush()
+                backoff = None
+            except Exception:
+                backoff = min(backoff * 2, self.max_retry_backoff) if backoff else self.retry_backoff
+                log.exception("%s flush failed, retrying in %ss", type(self).__name__, backoff)
+
+    async def flush(self):
+        if self._flushing is None:
+            self._flushing = asyncio.Lock()
+        # one flush at a time so batches reach the database in the order they were taken
+        async with self._flushing:
+            with self._lock:
+                batch = self._take()
+            if not batch:
+                return
+            start = time.monotonic()
+            try:
+                await self._write(batch)
+            except Exception:
+                with self._lock:
+                    self._restore(batch)
+                self.counters["failed"] += len(batch)
+                raise
+            with self._lock:
+                self._written(batch)
+            latency = time.monotonic() - start
+            self.counters["flushes"] += 1
+            self.counters["flushed"] += len(batch)
+            self.flush_latency["count"] += 1
+            self.flush_latency["total"] += latency
+            self.flush_latency["max"] = max(self.flush_latency["max"], latency)
+
+    def metrics(self):
+        latency = self.flush_latency
+        return {
+            **self.counters,
+            "depth": self.depth(),
+            "avg_latency": latency["total"] / latency["count"] if latency["count"] else 0.0,
+            "max_latency": latency["max"],
+        }
+
+    def depth(self):
+        raise NotImplementedError
+
+    def _pending_changed(self, depth):
+        if depth >= self.max_pending and self._full is not None:
+            self._full.set()
+
+    def _take(self):
+        raise NotImplementedError
+
+    def _restore(self, batch):
+        raise NotImplementedError
+
+    def _written(self, batch):
+        pass
+
+    async def _write(self, batch):
+        raise NotImplementedError
+
+
+class CooldownBuffer(WriteBuffer):
+    """
+    Write-behind buffer for cooldowns. Writes are deduplicated per (profile, type) so the
+    last one wins, and a pending eviction is stored as `None`. The batch being flushed is kept
+    in `_inflight` until it commits so that readers still see it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = {}
+        self._inflight = {}
+
+    def put(self, profile_id, cooldown_type, after):
+        with self._lock:
+            self._pending[(profile_id, cooldown_type)] = after
+            depth = len(self._pending)
+        # whocan shouldn't have to wait for the flush
+        readiness.set(profile_id, cooldown_type, after)
+        self._pending_changed(depth)
+
+    def evict(self, profile_id, cooldown_type):
+        self.put(profile_id, cooldown_type, None)
+
+    def pending_for(self, profile_id):
+        """Writes for a profile that have not reached the database yet, `{type: after or None}`."""
+        with self._lock:
+            writes = {**self._inflight, **self._pending}
+        return {_type: after for (_profile_id, _type), after in writes.items() if _profile_id == profile_id}
+
+    def depth(self):
+        return len(self._pending)
+
+    def _take(self):
+        batch, self._pending = self._pending, {}
+        self._inflight = batch
+        return batch
+
+    def _restore(self, batch):
+        # anything queued since the batch was taken is newer
+        self._pending = {**batch, **self._pending}
+        self._inflight = {}
+
+    def _written(self, batch):
+        self._inflight = {}
+
+    async def _write(self, batch):
+        updates, evictions = [], []
+        for (profile_id, cooldown_type), after in batch.items():
+            if after is None:
+                evictions.append({"profile_id": profile_id, "type": cooldown_type})
+            else:
+                updates.append(CoolDown(profile_id=profile_id, type=cooldown_type, after=after))
+        await (aio.sync_cooldowns if aio.enabled else sync_cooldowns)(updates, evictions)
+
+
+cooldown_buffer = CooldownBuffer()
+
+
+class EventBuffer(WriteBuffer):
+    """
+    Append-only buffer for Gamble and Hunt rows, written with bulk_create. Also remembers who
+    has started a hunt recently so that a hunt result can be attributed without a database lookup.
+    """
+
+    flush_interval, max_pending = 1.0, 500
+    # a hunt result has to show up this soon after `rpg hunt` to be attributed to that player
+    HUNT_EXPIRATION = datetime.timedelta(seconds=10)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = []
+        self._open_hunts = {}
+
+    def put(self, instance):
+        with self._lock:
+            self._pending.append(instance)
+            depth = len(self._pending)
+        self._pending_changed(depth)
+
+    def open_hunt(self, profile_id):
+        self._open_hunts[profile_id] = datetime.datetime.now(tz=datetime.timezone.utc)
+
+    def close_hunt(self, possible_userids, target, money, xp, loot):
+        expiration = datetime.datetime.now(tz=datetime.timezone.utc) - self.HUNT_EXPIRATION
+        # just have to do best effort in the case of nickname collision
+        for profile_id in possible_userids:
+            opened = self._open_hunts.pop(profile_id, None)
+            if opened and opened >= expiration:
+                self.put(Hunt(profile_id=profile_id, target=target, money=money, xp=xp, loot=loot))
+                return
+
+    def depth(self):
+        return len(self._pending)
+
+    def _take(self):
+        batch, self._pending = self._pending, []
+        return batch
+
+    def _restore(self, batch):
+        self._pending = batch + self._pending
+
+    async def _write(self, batch):
+        await (aio.insert_events if aio.enabled else insert_events)(batch)
+
+
+event_buffer = EventBuffer()
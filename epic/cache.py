@@ -0,0 +1,304 @@
+import time
+import datetime
+import threading
+
+from collections import OrderedDict
+
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save, post_delete
+
+from .models import CoolDown, Guild, Server, Profile, Gamble, Hunt
+from .utils import get_timezone
+
+MISSING = object()
+
+
+class ServerCache:
+    """
+    In-process copy of the Server table so that the message hot path rarely has to ask the
+    database whether a guild is registered. Unregistered guilds are remembered as `None`.
+    Saves in this process update the cache through post_save; entries expire after `ttl`
+    seconds so that changes made elsewhere (the admin runs in the web process) are picked up.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._servers = {}
+
+    def load(self):
+        expires = time.monotonic() + self.ttl
+        self._servers = {server.id: (expires, server) for server in Server.objects.all()}
+
+    def get(self, server_id):
+        expires, server = self._servers.get(server_id, (None, MISSING))
+        if expires is not None and expires <= time.monotonic():
+            return MISSING
+        return server
+
+    def set(self, server_id, server):
+        self._servers[server_id] = (time.monotonic() + self.ttl, server)
+
+
+server_cache = ServerCache()
+
+
+class ProfileCache:
+    """
+    Bounded LRU of Profile field values keyed by uid. Saves go through post_save, so
+    reads never have to hit the database. Every lookup builds its own instance, callers
+    on different database threads never share one.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+        self._attnames = [field.attname for field in Profile._meta.concrete_fields]
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, uid):
+        with self._lock:
+            values = self._profiles.get(str(uid))
+            if values is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+            self._profiles.move_to_end(str(uid))
+        # related objects (player_guild in particular) are fetched fresh, like on an uncached profile
+        return Profile.from_db(DEFAULT_DB_ALIAS, self._attnames, values)
+
+    def get_or_create(self, uid, defaults):
+        profile = self.get(uid)
+        if profile is not None:
+            return profile, False
+        profile, created = Profile.objects.get_or_create(uid=str(uid), defaults=defaults)
+        self.set(profile)
+        return profile, created
+
+    def set(self, profile, replace_only=False):
+        uid = str(profile.uid)
+        values = tuple(getattr(profile, attname) for attname in self._attnames)
+        with self._lock:
+            if replace_only and uid not in self._profiles:
+                return
+            self._profiles[uid] = values
+            self._profiles.move_to_end(uid)
+            while len(self._profiles) > self.maxsize:
+                self._profiles.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def invalidate(self, uids):
+        """Forget `uids` once the current transaction, if any, commits."""
+        uids = [str(uid) for uid in uids]
+        transaction.on_commit(lambda: self.forget(uids))
+
+    def forget(self, uids):
+        with self._lock:
+            for uid in uids:
+                self._profiles.pop(str(uid), None)
+
+
+profile_cache = ProfileCache()
+
+
+class CooldownView:
+    """What `rcd cd` shows for one profile, with every stored timestamp already formatted."""
+
+    # sorts first and is never shown, like a guild whose next raid is unknown
+    UNKNOWN = datetime.datetime(1790, 1, 1, tzinfo=datetime.timezone.utc)
+    READY_LINES = {c[0]: f":white_check_mark: `{c[0]:12} {'Ready!':>20}` \n" for c in CoolDown.COOLDOWN_TYPE_CHOICES}
+    __slots__ = ("guild", "timezone", "time_format", "types", "cooldowns")
+
+    def __init__(self, profile, cooldowns, guild_after=MISSING):
+        self.guild = profile.player_guild_id
+        self.timezone, self.time_format = get_timezone(profile.timezone), profile.time_format
+        self.types = tuple(
+            c[0] for c in CoolDown.COOLDOWN_TYPE_CHOICES if c[0] != "guild" or guild_after is not MISSING
+        )
+        # type -> (after, line)
+        self.cooldowns = {cooldown_type: (after, self.line(cooldown_type, after)) for cooldown_type, after in cooldowns}
+        if guild_after is not MISSING:
+            self.cooldowns["guild"] = (
+                (guild_after, self.line("guild", guild_after)) if guild_after else (self.UNKNOWN, "")
+            )
+
+    def line(self, cooldown_type, after):
+        after = after.astimezone(self.timezone).strftime(self.time_format)
+        return f":clock2: `{cooldown_type:12} {after:>20}`\n"
+
+
+class CooldownViewCache:
+    """
+    Bounded LRU of `CooldownView`s keyed by uid so that repeated `rcd cd` calls don't touch
+    the database. Anything that writes cooldowns, a profile or a guild's next raid drops the
+    affected views once its transaction commits.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped by every invalidation so a view built from data read before it is not stored
+        self._generation = 0
+        self.counters = {"hits": 0, "misses": 0}
+
+    def get(self, profile):
+        uid = str(profile.uid)
+        with self._lock:
+            view = self._views.get(uid)
+            if view is not None:
+                self.counters["hits"] += 1
+                self._views.move_to_end(uid)
+                return view
+            self.counters["misses"] += 1
+            generation = self._generation
+        view = self._build(profile)
+        with self._lock:
+            if generation == self._generation:
+                self._views[uid] = view
+                while len(self._views) > self.maxsize:
+                    self._views.popitem(last=False)
+        return view
+
+    def invalidate(self, uids):
+        """Drop the views of `uids` once the current transaction, if any, commits."""
+        uids = {str(uid) for uid in uids}
+        transaction.on_commit(lambda: self.discard(uids))
+
+    def invalidate_guild(self, names):
+        names = set(names)
+        transaction.on_commit(lambda: self._drop(lambda uid, view: view.guild in names))
+
+    def clear(self):
+        transaction.on_commit(lambda: self._drop(lambda uid, view: True))
+
+    def discard(self, uids):
+        """Drop the views of `uids` right away, for writes that did not go through the ORM."""
+        uids = {str(uid) for uid in uids}
+        self._drop(lambda uid, view: uid in uids)
+
+    def _drop(self, predicate):
+        with self._lock:
+            self._generation += 1
+            for uid in [uid for uid, view in self._views.items() if predicate(uid, view)]:
+                del self._views[uid]
+
+    @staticmethod
+    def _build(profile):
+        cooldowns = CoolDown.objects.filter(profile_id=profile.pk).values_list("type", "after")
+        guild_after = MISSING
+        if profile.player_guild_id:
+            guild_after = Guild.objects.filter(name=profile.player_guild_id).values_list("after", flat=True).first()
+        return CooldownView(profile, cooldowns, guild_after)
+
+
+cooldown_views = CooldownViewCache()
+
+
+class StatsCache:
+    """
+    Bounded LRU of formatted `rcd gambling|hunts|drops` results keyed on
+    `(uid or "all", minutes, server_id, kind)`. Windowed results expire after `window_ttl`
+    seconds, lifetime results are kept until new rows of their kind are ingested.
+    """
+
+    # the stats kinds each model feeds
+    KINDS = {Gamble: ("gambling",), Hunt: ("hunts", "drops")}
+
+    def __init__(self, maxsize=512, window_ttl=15):
+        self.maxsize = maxsize
+        self.window_ttl = window_ttl
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    def get(self, kind, uid, minutes, server_id, compute):
+        """The cached result or `compute(uid, minutes, server_id)`, which is stored for next time."""
+        key = (str(uid) if uid else "all", minutes, server_id, kind)
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None:
+                expires, fields = entry
+                if expires is None or expires > time.monotonic():
+                    self.counters["hits"] += 1
+                    self._results.move_to_end(key)
+                    return fields
+                self.counters["expired"] += 1
+                del self._results[key]
+            self.counters["misses"] += 1
+            generation = self._generation
+        # some of the managers return generators
+        fields = tuple(compute(uid, minutes, server_id))
+        with self._lock:
+            if generation == self._generation:
+                self._results[key] = (time.monotonic() + self.window_ttl if minutes else None, fields)
+                while len(self._results) > self.maxsize:
+                    self._results.popitem(last=False)
+                    self.counters["evictions"] += 1
+        return fields
+
+    def invalidate(self, instances):
+        """Drop the lifetime results that `instances` change once the current transaction, if any, commits."""
+        stale = self._stale(instances)
+        transaction.on_commit(lambda: self._drop(stale))
+
+    def discard(self, instances):
+        """Same as `invalidate` right away, for writes that did not go through the ORM."""
+        self._drop(self._stale(instances))
+
+    def metrics(self):
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "size": len(self._results),
+            "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+        }
+
+    def _stale(self, instances):
+        stale = set()
+        for instance in instances:
+            for kind in self.KINDS.get(type(instance), ()):
+                stale.update(((str(instance.profile_id), kind), ("all", kind)))
+        return stale
+
+    def _drop(self, stale):
+        if not stale:
+            return
+        with self._lock:
+            self._generation += 1
+            for key in [key for key in self._results if key[1] is None and (key[0], key[3]) in stale]:
+                del self._results[key]
+
+
+stats_cache = StatsCache()
+
+
+def _server_saved(sender, instance, **kwargs):
+    server_cache.set(instance.id, instance)
+
+
+def _server_deleted(sender, instance, **kwargs):
+    server_cache.set(instance.id, None)
+
+
+def _profile_saved(sender, instance, **kwargs):
+    profile_cache.set(instance, replace_only=True)
+    # timezone, time format or guild may have changed
+    cooldown_views.invalidate([instance.uid])
+
+
+def _profile_deleted(sender, instance, **kwargs):
+    profile_cache.invalidate([instance.uid])
+    cooldown_views.invalidate([instance.uid])
+
+
+def _guild_saved(sender, instance, **kwargs):
+    cooldown_views.invalidate_guild([instance.name])
+
+
+post_save.connect(_server_saved, sender=Server)
+post_delete.connect(_server_deleted, sender=Server)
+post_save.connect(_profile_saved, sender=Profile)
+post_delete.connect(_profile_deleted, sender=Profile)
+post_save.connect(_guild_saved, sender=Guild)
@@ -0,0 +1,39 @@
+import re
+
+from .models import Gamble
+from .utils import Enum
+
+MESSAGE_KINDS = Enum(["COOLDOWN_LIST", "COOLDOWN_RESPONSE", "GAMBLE", "HUNT", "GUILD_ROSTER", "IGNORE"])
+
+# an author name can contain more than one cue (e.g. a player named "dice"),
+# the earlier kind in this list wins just like it did with the chained `in` checks
+AUTHOR_CUE_PRIORITY = [MESSAGE_KINDS.COOLDOWN_LIST, MESSAGE_KINDS.COOLDOWN_RESPONSE, MESSAGE_KINDS.GAMBLE]
+author_cue_regex = re.compile(
+    r"(?P<COOLDOWN_LIST>cooldowns|ready)|(?P<COOLDOWN_RESPONSE>cooldown)|(?P<GAMBLE>{})".format(
+        "|".join(map(re.escape, Gamble.GAME_CUE_MAP.keys()))
+    )
+)
+guild_roster_regex = re.compile(r"\*\*(?P<guild_name>[^\*]+)\*\* members")
+roster_player_regex = re.compile(r"\*\*(?P<player_name>[^\*]+)\*\*")
+HUNT_CUE = "found and killed"
+
+
+def classify(message):
+    """
+    Label an EPIC RPG message in one pass so that irrelevant messages can be dropped
+    before any parsing or database work. Returns `(kind, embed)` where `embed` is the
+    embed that carried the cue, if any.
+    """
+    if HUNT_CUE in message.content:
+        return MESSAGE_KINDS.HUNT, None
+    for embed in message.embeds:
+        # before the author cues, a roster's author is a player name that could contain one (e.g. "Candice")
+        if embed.fields and guild_roster_regex.match(embed.fields[0].name):
+            return MESSAGE_KINDS.GUILD_ROSTER, embed
+        author_name = getattr(embed.author, "name", None)
+        if author_name:
+            kinds = {match.lastgroup for match in author_cue_regex.finditer(author_name)}
+            for kind in AUTHOR_CUE_PRIORITY:
+                if kind in kinds:
+                    return kind, embed
+    return MESSAGE_KINDS.IGNORE, None
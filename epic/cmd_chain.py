@@ -1,17 +1,17 @@
 import re
-import pytz
 import discord
 import datetime
 import operator
 import functools
 
-from asgiref.sync import sync_to_async
-from pipeline import execution_pipeline
-
 from django.forms.models import model_to_dict
 
 from epic.models import CoolDown, Profile, Server, JoinCode, Gamble, Hunt
-from epic.utils import tokenize
+from epic.utils import get_timezone, tokenize
+from epic.cache import cooldown_views, profile_cache, stats_cache
+from epic.readiness import readiness
+from epic.buffers import cooldown_buffer
+from epic.db import lanes
 
 
 class RCDMessage:
@@ -58,46 +58,39 @@ class SuccessMessage(RCDMessage):
     color = 0x628F47
 
 
-def params_as_args(func):
-    arg_names = ["client", "tokens", "message", "server", "profile", "msg", "help"]
+# command name or alias -> handler, see `command` and `resolve`
+ROUTES = {}
 
-    @functools.wraps(func)
-    def wrapper(params):
-        if params["msg"] or params.get("error", None):
-            # short-circuit to prevent running
-            # the rest of the command chain
-            return params
-        # if they are using commands, we want to go ahead and
-        # make them a profile.
-        if params["profile"] is None:
-            message, server, tokens, help = params["message"], params["server"], params["tokens"], params["help"]
-            if server is not None:
-                profile, _ = Profile.objects.get_or_create(
-                    uid=message.author.id,
-                    defaults={
-                        "last_known_nickname": message.author.name,
-                        "server": server,
-                        "channel": message.channel.id,
-                    },
-                )
-                params["profile"] = profile
-            elif not help and tokens and tokens[0] not in {"help", "register"}:
-                params["msg"] = ErrorMessage(
-                    "You can only use `help` and `register` commands until "
-                    f"{message.channel.guild.name} has used a join code."
-                )
-        args = [params.get(arg_name, None) for arg_name in arg_names]
-        res = func(*args)
-        if not res:
-            return params
-        params.update(res)
-        return params
 
-    return wrapper
+def command(*names, needs_profile=True):
+    """
+    Route each of `names` to the decorated handler. The author's profile is only
+    loaded (or created) for handlers that need it.
+    """
+
+    def decorator(func):
+        func.needs_profile = needs_profile
+        for name in names:
+            ROUTES[name] = func
+        return func
+
+    return decorator
+
+
+def resolve(tokens):
+    handler = ROUTES.get(tokens[0])
+    if handler:
+        return handler
+    if (tokens[0] in CoolDown.COOLDOWN_MAP or tokens[0] == "all") and tokens[-1] in {"on", "off"}:
+        # `rcd hunt on` is `rcd notify hunt on`
+        return notify
+    if tokens[0] in CoolDown.COOLDOWN_MAP or Profile.user_id_regex.match(tokens[0]):
+        # `rcd daily` and `rcd @player` are `rcd cd ...`
+        return cd
+    return None
 
 
-@params_as_args
-def _help(client, tokens, message, server, profile, msg, help=None, error=None):
+def _help(tokens):
     """
 
     Call `help` on an available command to see it's usage. Example:
@@ -131,14 +124,14 @@ def _help(client, tokens, message, server, profile, msg, help=None, error=None):
         # default command is now cd instead of help
         return {"tokens": ["cd"]}
     if tokens[0] not in {"help", "h"}:
-        return
+        return {"tokens": tokens}
     if len(tokens) == 1:
         return {"msg": HelpMessage(_help.__doc__)}
     return {"help": True, "tokens": tokens[1:]}
 
 
-@params_as_args
-def cd(client, tokens, message, server, profile, msg, help=None):
+@command("cd")
+def cd(client, tokens, message, server, profile, help=None):
     """
     Display when your cooldowns are expected to be done.
     Usage:
@@ -149,13 +142,11 @@ def cd(client, tokens, message, server, profile, msg, help=None):
         • `rcd daily weekly`
     """
     implicit_invocation = False
-    if tokens[0] in CoolDown.COOLDOWN_MAP or re.match(r"<@!?(?P<user_id>\d+)>", tokens[0]):
+    if tokens[0] in CoolDown.COOLDOWN_MAP or Profile.user_id_regex.match(tokens[0]):
         # allow implicit invocation of cd
         tokens, implicit_invocation = ["cd", *tokens], True
     nickname = message.author.name
     cooldown_filter = lambda x: True  # show all filters by default
-    if tokens[0] != "cd":
-        return None
     if help and len(tokens) == 1:
         return {"msg": HelpMessage(cd.__doc__)}
     elif len(tokens) > 1:
@@ -170,46 +161,44 @@ def cd(client, tokens, message, server, profile, msg, help=None):
         if cd_args:
             cooldown_filter = lambda x: x in cd_args
 
-    profile_tz = pytz.timezone(profile.timezone)
     now = datetime.datetime.now(tz=datetime.timezone.utc)
-    default = datetime.datetime(1790, 1, 1, tzinfo=datetime.timezone.utc)
     msg = ""
-    cooldowns = {
-        _cd[0]: _cd[1]
-        for _cd in CoolDown.objects.filter(profile_id=profile.pk).order_by("after").values_list("type", "after")
-    }
-    all_cooldown_types = set([c[0] for c in CoolDown.COOLDOWN_TYPE_CHOICES])
-    if not profile.player_guild:
-        all_cooldown_types = all_cooldown_types - {"guild"}
-    else:
-        cooldowns["guild"] = profile.player_guild.after if profile.player_guild.after else default
+    view = cooldown_views.get(profile)
+    cooldowns = view.cooldowns
+    # writes that are still buffered win over what is in the database
+    pending = cooldown_buffer.pending_for(profile.pk)
+    if pending:
+        cooldowns = dict(cooldowns)
+        for cooldown_type, after in pending.items():
+            if after is None:
+                cooldowns.pop(cooldown_type, None)
+            else:
+                cooldowns[cooldown_type] = (after, view.line(cooldown_type, after))
     selected_cooldown_types = sorted(
-        filter(cooldown_filter, all_cooldown_types),
-        key=lambda x: cooldowns[x] if x in cooldowns else default,
+        filter(cooldown_filter, view.types),
+        key=lambda x: cooldowns[x][0] if x in cooldowns else view.UNKNOWN,
     )
+    # only "ready or not" depends on the current time
     for cooldown_type in selected_cooldown_types:
-        after = cooldowns.get(cooldown_type, None)
-        if after:
+        if cooldown_type in cooldowns:
+            after, line = cooldowns[cooldown_type]
             if after > now:
-                cooldown_after = cooldowns[cooldown_type].astimezone(profile_tz)
-                msg += f":clock2: `{cooldown_type:12} {cooldown_after.strftime(profile.time_format):>20}`\n"
+                msg += line
         else:
-            msg += f":white_check_mark: `{cooldown_type:12} {'Ready!':>20}` \n"
+            msg += view.READY_LINES[cooldown_type]
     if not msg:
         msg = "Please use `rpg cd` or an EPIC RPG command to populate your cooldowns.\n"
     return {"msg": NormalMessage(msg, title=f"**{nickname}'s** Cooldowns ({profile.timezone})")}
 
 
-@params_as_args
-def register(client, tokens, message, server, profile, msg, help=None, error=None):
+@command("register", needs_profile=False)
+def register(client, tokens, message, server, profile, help=None):
     """
         Register your server for use with Epic Reminder.
     Compute resources are limited, so invite codes will be doled out sparingly.
     Example:
         • `rcd register asdf` attempts to register the server using the join code `asdf`
     """
-    if tokens[0] != "register":
-        return None
     if help or len(tokens) == 1:
         return {"msg": HelpMessage(register.__doc__)}
     if server:
@@ -228,8 +217,8 @@ def register(client, tokens, message, server, profile, msg, help=None, error=Non
     return {"msg": SuccessMessage(f"Welcome {message.channel.guild.name}!", title="Welcome!")}
 
 
-@params_as_args
-def _profile(client, tokens, message, server, profile, msg, help=None):
+@command("profile", "p")
+def _profile(client, tokens, message, server, profile, help=None):
     """
     When called without any arguments, e.g. `rcd profile` this will display
     profile-related information. Otherwise, it will treat your input as a profile related sub-command.
@@ -248,8 +237,6 @@ def _profile(client, tokens, message, server, profile, msg, help=None):
         • `rcd p notify hunt on` Turns on hunt notifications for your profile.
         • `rcd p hunt on` Turns on hunt notifications for your profile.
     """
-    if tokens[0] not in {"profile", "p"}:
-        return None
     if help and len(tokens) == 1:
         return {"msg": HelpMessage(_profile.__doc__)}
     elif len(tokens) > 1:
@@ -283,8 +270,8 @@ def _profile(client, tokens, message, server, profile, msg, help=None):
     }
 
 
-@params_as_args
-def notify(client, tokens, message, server, profile, msg, help=None):
+@command("notify", "n")
+def notify(client, tokens, message, server, profile, help=None):
     """
         Manage your notification settings. Here you can specify which types of
     epic rpg commands you would like to receive reminders for. For example, you can
@@ -319,7 +306,7 @@ def notify(client, tokens, message, server, profile, msg, help=None):
         for token in {*tokens[1:-1]}:
             if token not in CoolDown.COOLDOWN_MAP and token != "all":
                 return {"error": 1}
-    if tokens[0] not in {"notify", "n"} or len(tokens) == 2:
+    if len(tokens) == 2:
         return None
     if help or len(tokens) == 1:
         return {"msg": HelpMessage(notify.__doc__)}
@@ -348,14 +335,12 @@ def notify(client, tokens, message, server, profile, msg, help=None):
         }
 
 
-@params_as_args
-def on(client, tokens, message, server, profile, msg, help=None):
+@command("on")
+def on(client, tokens, message, server, profile, help=None):
     """
     Toggle your profile notifications **on**. Example:
       • `rcd on`
     """
-    if tokens[0] != "on":
-        return None
     if help and len(tokens) == 1:
         return {"msg": HelpMessage(on.__doc__)}
     elif len(tokens) != 1:
@@ -365,14 +350,12 @@ def on(client, tokens, message, server, profile, msg, help=None):
     return {"msg": SuccessMessage(f"Notifications are now **on** for **{message.author.name}**.")}
 
 
-@params_as_args
-def off(client, tokens, message, server, profile, msg, help=None):
+@command("off")
+def off(client, tokens, message, server, profile, help=None):
     """
     Toggle your profile notifications **off**. Example:
       • `rcd off`
     """
-    if tokens[0] != "off":
-        return None
     if help and len(tokens) == 1:
         return {"msg": HelpMessage(off.__doc__)}
     elif len(tokens) != 1:
@@ -382,8 +365,8 @@ def off(client, tokens, message, server, profile, msg, help=None):
     return {"msg": SuccessMessage(f"Notifications are now **off** for **{message.author.name}**.")}
 
 
-@params_as_args
-def timezone(client, tokens, message, server, profile, msg, help=None):
+@command("timezone", "tz")
+def timezone(client, tokens, message, server, profile, help=None):
     """
     Set your timezone. Example:
         • `rcd timezone <timezone>` Sets your timezone to the provided timzone.
@@ -391,10 +374,7 @@ def timezone(client, tokens, message, server, profile, msg, help=None):
           is not effected.)
         • `rcd tz default` Sets your timezone back to the default.
     """
-    command = tokens[0]
-    if command not in {"timezone", "tz"}:
-        return None
-    current_time = datetime.datetime.now().astimezone(pytz.timezone(profile.timezone))
+    current_time = datetime.datetime.now().astimezone(get_timezone(profile.timezone))
     if help or len(tokens) == 1:
         return {
             "msg": HelpMessage(
@@ -435,8 +415,8 @@ def timezone(client, tokens, message, server, profile, msg, help=None):
             }
 
 
-@params_as_args
-def timeformat(client, tokens, message, server, profile, msg, help=None):
+@command("timeformat", "tf")
+def timeformat(client, tokens, message, server, profile, help=None):
     """
     Set the time format for the output of rcd using Python
     `strftime` notation. Defaults to `%I:%M:%S %p, %m/%d`. If
@@ -451,12 +431,8 @@ def timeformat(client, tokens, message, server, profile, msg, help=None):
 
     Don't worry, you will not be able to save an invalid time format.
     """
-
-    command = tokens[0]
-    if command not in {"timeformat", "tf"}:
-        return None
     itokens = tokenize(message.content[:250], preserve_case=True)
-    current_time = datetime.datetime.now().astimezone(pytz.timezone(profile.timezone)).strftime(profile.time_format)
+    current_time = datetime.datetime.now().astimezone(get_timezone(profile.timezone)).strftime(profile.time_format)
     if help or len(tokens) == 1:
         return {
             "msg": HelpMessage(
@@ -495,7 +471,7 @@ def timeformat(client, tokens, message, server, profile, msg, help=None):
     if time_format.lower() == "default":
         time_format = Profile.DEFAULT_TIME_FORMAT
     try:
-        current_time = datetime.datetime.now().astimezone(pytz.timezone(profile.timezone)).strftime(time_format)
+        current_time = datetime.datetime.now().astimezone(get_timezone(profile.timezone)).strftime(time_format)
         profile.update(time_format=time_format)
         return {
             "msg": SuccessMessage(
@@ -512,15 +488,13 @@ def timeformat(client, tokens, message, server, profile, msg, help=None):
         }
 
 
-@params_as_args
-def whocan(client, tokens, message, server, profile, msg, help=None):
+@command("whocan", "w")
+def whocan(client, tokens, message, server, profile, help=None):
     """
     Determine who in your server can use a particular command. Example:
       • `rcd whocan dungeon`
       • `rcd w dungeon`
     """
-    if tokens[0] not in {"whocan", "w"}:
-        return None
     if help or len(tokens) == 1:
         return {"msg": HelpMessage(whocan.__doc__)}
 
@@ -541,15 +515,7 @@ def whocan(client, tokens, message, server, profile, msg, help=None):
     else:
         cooldown_type = cooldown_type_func(None)
 
-    ats = [
-        f"<@{uid}>"
-        for uid in set(
-            Profile.objects.exclude(uid=profile.uid)
-            .exclude(cooldown__type=cooldown_type)
-            .filter(server_id=message.channel.guild.id)
-            .values_list("uid", flat=True)
-        )
-    ]
+    ats = [f"<@{uid}>" for uid in sorted(readiness.ready(message.channel.guild.id, cooldown_type) - {profile.uid})]
     if ats:
         msg = f"All of these players can `{rpg_command}`: \n\n" + "\n\t".join(ats)
         msg += f"\n\nExample: \n\n```rpg {rpg_command} {' '.join(ats)}\n\n```"
@@ -557,8 +523,8 @@ def whocan(client, tokens, message, server, profile, msg, help=None):
     return {"msg": NormalMessage("Sorry, no one can do that right now.")}
 
 
-@params_as_args
-def dibbs(client, tokens, message, server, profile, msg, help=None):
+@command("dibbs", "dibbs?", "d", "d?")
+def dibbs(client, tokens, message, server, profile, help=None):
     """
     Call "dibbs" on the guild raid.
     Usage:
@@ -567,8 +533,6 @@ def dibbs(client, tokens, message, server, profile, msg, help=None):
         • `rcd dibbs` Call dibbs on next guild raid
         • `rcd dibbs?` Find out if anyone has dibbs without claiming it
     """
-    if tokens[0] not in {"dibbs", "dibbs?", "d", "d?"}:
-        return None
     if help:
         return {"msg": HelpMessage(dibbs.__doc__)}
     if not profile.player_guild:
@@ -580,7 +544,7 @@ def dibbs(client, tokens, message, server, profile, msg, help=None):
                 "in a channel that I can see and try again."
             )
         }
-    tz, tf = pytz.timezone(profile.timezone), profile.time_format
+    tz, tf = get_timezone(profile.timezone), profile.time_format
     after = profile.player_guild.after.astimezone(tz).strftime(tf)
     raid_dibbs = profile.player_guild.raid_dibbs
     if tokens[0][-1] == "?":
@@ -601,8 +565,8 @@ def dibbs(client, tokens, message, server, profile, msg, help=None):
         return {"msg": NormalMessage(f"Sorry, **{player_with_dibbs}** already has dibbs.", title="Not this time!")}
 
 
-@params_as_args
-def stats(client, tokens, message, server, profile, msg, help=None):
+@command("gambling", "g", "drops", "dr", "hunts", "hu")
+def stats(client, tokens, message, server, profile, help=None):
     """
     This command shows the output of {long} stats that the helper bot has managed to collect.
     Usage:
@@ -621,8 +585,6 @@ def stats(client, tokens, message, server, profile, msg, help=None):
         "hunts": ("hunts", "hu"),
         "hu": ("hunts", "hu"),
     }
-    if tokens[0] not in token_map:
-        return None
     long, short = token_map[tokens[0]]
     if help:
         return {"msg": HelpMessage(stats.__doc__.format(long=long, short=short))}
@@ -650,46 +612,67 @@ def stats(client, tokens, message, server, profile, msg, help=None):
     if long == "gambling":
         return {
             "msg": NormalMessage(
-                "", fields=Gamble.objects.stats(uid, minutes, server.id), title=f"{name}'s Gambling Addiction"
+                "",
+                fields=stats_cache.get(long, uid, minutes, server.id, Gamble.objects.stats),
+                title=f"{name}'s Gambling Addiction",
             )
         }
     elif long == "hunts":
         return {
-            "msg": NormalMessage("", fields=Hunt.objects.hunt_stats(uid, minutes, server.id), title=f"{name}'s Carnage")
+            "msg": NormalMessage(
+                "",
+                fields=stats_cache.get(long, uid, minutes, server.id, Hunt.objects.hunt_stats),
+                title=f"{name}'s Carnage",
+            )
         }
     elif long == "drops":
         return {
-            "msg": NormalMessage("", fields=Hunt.objects.drop_stats(uid, minutes, server.id), title=f"{name}'s Drops")
+            "msg": NormalMessage(
+                "",
+                fields=stats_cache.get(long, uid, minutes, server.id, Hunt.objects.drop_stats),
+                title=f"{name}'s Drops",
+            )
         }
 
 
-command_pipeline = execution_pipeline(
-    pre=[
-        _help,  # needs to be first to pass "help" param to those that follow
-        whocan,
-        # most commands that follow can be invoked as profile subcommand
-        _profile,
-        notify,  # notify must be before cd so `rcd hunt on` works
-        # cd allows arbitrary arguments so it must follow
-        # all other commands that can be invoked implicitly
-        cd,
-        stats,
-        on,
-        off,
-        dibbs,
-        timezone,
-        timeformat,
-        register,  # called rarely, should be last.
-    ],
-)
-
-
-@sync_to_async
-@command_pipeline
-def handle_rpcd_message(client, tokens, message, server, profile, msg, help=None, error=None):
+def _handle_rpcd_message(client, tokens, message, server, profile=None):
+    res = _help(tokens)
+    if server is None and "msg" not in res and (not tokens or tokens[0] not in {"help", "register"}):
+        return ErrorMessage(
+            "You can only use `help` and `register` commands until "
+            f"{message.channel.guild.name} has used a join code."
+        )
+    help, tokens = res.get("help"), res.get("tokens")
+    handler = resolve(tokens) if tokens else None
+    while handler:
+        # if they are using commands, we want to go ahead and
+        # make them a profile.
+        if handler.needs_profile and profile is None and server is not None:
+            profile, _ = profile_cache.get_or_create(
+                message.author.id,
+                defaults={
+                    "last_known_nickname": message.author.name,
+                    "server": server,
+                    "channel": message.channel.id,
+                },
+            )
+        res = handler(client, tokens, message, server, profile, help) or {}
+        # `rcd p <command>` hands the rest of the tokens to another command
+        tokens = res.get("tokens")
+        handler = resolve(tokens) if tokens else None
+    msg, error = res.get("msg"), res.get("error")
     if (error and not isinstance(error, str)) or not msg:
         original_tokens = tokenize(message.content[:250], preserve_case=True)
         return ErrorMessage(f"`{' '.join(original_tokens)}` could not be parsed as a valid command.")
     elif error:
         return ErrorMessage(error)
     return msg
+
+
+# stats aggregate over the whole history, so they run in the slow database lane
+SLOW_COMMANDS = {"gambling", "g", "drops", "dr", "hunts", "hu"}
+
+
+async def handle_rpcd_message(client, tokens, message, server, profile=None):
+    lane = "slow" if tokens and SLOW_COMMANDS.intersection(tokens[:2]) else "default"
+    return await lanes[lane].run(_handle_rpcd_message, client, tokens, message, server, profile)
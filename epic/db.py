@@ -0,0 +1,115 @@
+import time
+import asyncio
+import functools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+# WAL lets the notifier read while a handler writes, and with synchronous=NORMAL a commit no longer waits on an fsync
+# (a crash can lose the last commits, but never corrupts the database)
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA mmap_size = 268435456",
+    # negative is in KiB, so 64MB per connection
+    "PRAGMA cache_size = -65536",
+    "PRAGMA temp_store = MEMORY",
+    # wait for the write lock instead of failing with "database is locked"
+    "PRAGMA busy_timeout = 5000",
+)
+
+
+def tune_sqlite(sender, connection, **kwargs):
+    """`connection_created` receiver that applies SQLITE_PRAGMAS to new SQLite connections when SQLITE_TUNED is set."""
+    if connection.vendor == "sqlite" and settings.SQLITE_TUNED:
+        with connection.cursor() as cursor:
+            for pragma in SQLITE_PRAGMAS:
+                cursor.execute(pragma)
+
+
+class DatabaseLane:
+    """
+    A bounded pool of threads for ORM work. Every thread keeps its own database
+    connection, which is reused for up to CONN_MAX_AGE seconds.
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"db-{name}")
+        self._lock = threading.Lock()
+        self.queued, self.running = 0, 0
+        self.counters = {"completed": 0, "failed": 0}
+        self.wait_latency = {"count": 0, "total": 0.0, "max": 0.0}
+        self.run_latency = {"count": 0, "total": 0.0, "max": 0.0}
+
+    async def run(self, func, *args, **kwargs):
+        submitted = time.monotonic()
+        with self._lock:
+            self.queued += 1
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(self._call, submitted, func, *args, **kwargs)
+        )
+
+    def _call(self, submitted, func, *args, **kwargs):
+        started = time.monotonic()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self._record(self.wait_latency, started - submitted)
+        # the same housekeeping Django does around a request: drop connections that are broken or too old
+        close_old_connections()
+        outcome = "failed"
+        try:
+            result = func(*args, **kwargs)
+            outcome = "completed"
+            return result
+        finally:
+            close_old_connections()
+            with self._lock:
+                self.running -= 1
+                self.counters[outcome] += 1
+                self._record(self.run_latency, time.monotonic() - started)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                **self.counters,
+                "queued": self.queued,
+                "running": self.running,
+                "avg_wait": self._average(self.wait_latency),
+                "max_wait": self.wait_latency["max"],
+                "avg_run": self._average(self.run_latency),
+                "max_run": self.run_latency["max"],
+            }
+
+    @staticmethod
+    def _average(latency):
+        return latency["total"] / latency["count"] if latency["count"] else 0.0
+
+    @staticmethod
+    def _record(latency, seconds):
+        latency["count"] += 1
+        latency["total"] += seconds
+        latency["max"] = max(latency["max"], seconds)
+
+
+# slow analytical queries (stats) get their own lane so they can't hold up cooldown writes
+lanes = {
+    "default": DatabaseLane("default", settings.DB_WORKERS),
+    "slow": DatabaseLane("slow", settings.DB_SLOW_WORKERS),
+}
+
+
+def db_sync_to_async(func=None, lane="default"):
+    """Like asgiref's sync_to_async, but runs the function on one of the database lanes."""
+    if func is None:
+        return functools.partial(db_sync_to_async, lane=lane)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await lanes[lane].run(func, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,186 @@
+import time
+import heapq
+import asyncio
+import logging
+import discord
+import itertools
+
+log = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 2000
+# how long the notifier waits after a deadline so reminders due together share a message
+COALESCE_WINDOW = 0.5
+
+
+def coalesce(messages, limit=MESSAGE_LIMIT):
+    """
+    Group `(message, channel_id)` pairs by channel and join each group
+    into as few messages as the character limit allows.
+    """
+    by_channel = {}
+    for message, channel_id in messages:
+        chunks = by_channel.setdefault(channel_id, [])
+        if chunks and len(chunks[-1]) + len(message) + 1 <= limit:
+            chunks[-1] = f"{chunks[-1]}\n{message}"
+        else:
+            chunks.append(message)
+    return by_channel
+
+
+class ChannelResolver:
+    """
+    Resolves channel ids from the gateway cache, falling back to a REST fetch whose
+    result is remembered. A missing or forbidden channel is only remembered for
+    `MISSING_TTL` seconds, since access can be granted again.
+    """
+
+    MISSING_TTL = 300
+
+    def __init__(self, client):
+        self.client = client
+        self._fetched = {}
+        self._missing = {}
+
+    async def get(self, channel_id):
+        channel = self.client.get_channel(channel_id) or self._fetched.get(channel_id)
+        if channel is not None:
+            return channel
+        if self._missing.get(channel_id, 0) > time.monotonic():
+            return None
+        try:
+            self._fetched[channel_id] = await self.client.fetch_channel(channel_id)
+        except (discord.NotFound, discord.Forbidden):
+            self._missing[channel_id] = time.monotonic() + self.MISSING_TTL
+            return None
+        self._missing.pop(channel_id, None)
+        return self._fetched[channel_id]
+
+
+class TokenBucket:
+    def __init__(self, rate, per):
+        self.capacity, self.fill_rate = rate, rate / per
+        self.tokens, self.updated = float(rate), time.monotonic()
+
+    def reserve(self):
+        """Take a token and return how long to wait before it may be used."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.fill_rate
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class PriorityGate:
+    """
+    Hands out a token bucket's tokens to the waiting senders by priority, then in the order they
+    arrived. The next token is waited for before picking who gets it, so a reply that shows up
+    in the meantime still goes first.
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self._waiters = []
+        self._order = itertools.count()
+        self._releaser = None
+
+    async def acquire(self, priority):
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), waiter))
+        if self._releaser is None or self._releaser.done():
+            self._releaser = asyncio.ensure_future(self._release())
+        await waiter
+
+    async def _release(self):
+        while self._waiters:
+            await self.bucket.acquire()
+            # a cancelled sender doesn't need its token, the next one in line gets it
+            while self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                if not waiter.done():
+                    waiter.set_result(None)
+                    break
+
+
+class Outbox:
+    """
+    Outbound message pipeline. Each channel gets its own priority queue drained by its
+    own task, so one slow channel does not hold up the others. Sends are paced by a
+    per-channel and a global token bucket that mirror Discord's rate limits. The global
+    tokens go through a PriorityGate, so a reply also goes ahead of the reminders
+    waiting in other channels.
+    """
+
+    REPLY, REMINDER = 0, 1
+    # Discord allows 5 messages per 5 seconds in a channel and 50 requests per second overall
+    CHANNEL_RATE, GLOBAL_RATE = (5, 5.0), (50, 1.0)
+
+    def __init__(self, channel_rate=CHANNEL_RATE, global_rate=GLOBAL_RATE):
+        self.channel_rate = channel_rate
+        self._global = PriorityGate(TokenBucket(*global_rate))
+        self._queues, self._workers, self._buckets = {}, {}, {}
+        self._order = itertools.count()
+        self.counters = {"queued": 0, "sent": 0, "failed": 0}
+        self.send_latency = {"count": 0, "total": 0.0, "max": 0.0}
+
+    def submit(self, channel, priority=REMINDER, **kwargs):
+        """Queue `channel.send(**kwargs)` without waiting for it."""
+        queue = self._queues.get(channel.id)
+        if queue is None:
+            queue = self._queues[channel.id] = asyncio.PriorityQueue()
+        queue.put_nowait((priority, next(self._order), time.monotonic(), channel, kwargs))
+        self.counters["queued"] += 1
+        worker = self._workers.get(channel.id)
+        if worker is None or worker.done():
+            self._workers[channel.id] = asyncio.ensure_future(self._drain(channel.id, queue))
+
+    def queue_depth(self, channel_id=None):
+        if channel_id is not None:
+            queue = self._queues.get(channel_id)
+            return queue.qsize() if queue else 0
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    def metrics(self):
+        latency = self.send_latency
+        return {
+            **self.counters,
+            "depth": self.queue_depth(),
+            "channels": len(self._queues),
+            "avg_latency": latency["total"] / latency["count"] if latency["count"] else 0.0,
+            "max_latency": latency["max"],
+        }
+
+    async def join(self):
+        """Wait until everything queued so far has been sent."""
+        for queue in list(self._queues.values()):
+            await queue.join()
+
+    async def _drain(self, channel_id, queue):
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = self._buckets[channel_id] = TokenBucket(*self.channel_rate)
+        while not queue.empty():
+            priority, _, queued_at, channel, kwargs = queue.get_nowait()
+            try:
+                await bucket.acquire()
+                await self._global.acquire(priority)
+                await channel.send(**kwargs)
+                self.counters["sent"] += 1
+            except discord.HTTPException:
+                self.counters["failed"] += 1
+                log.exception("Sending to channel %s failed", channel_id)
+            finally:
+                latency = time.monotonic() - queued_at
+                self.send_latency["count"] += 1
+                self.send_latency["total"] += latency
+                self.send_latency["max"] = max(self.send_latency["max"], latency)
+                queue.task_done()
+        # nothing left to send, the next submit starts a fresh worker
+        del self._queues[channel_id], self._workers[channel_id]
+
+
+outbox = Outbox()
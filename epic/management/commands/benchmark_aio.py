@@ -0,0 +1,87 @@
+import sys
+import time
+import random
+import asyncio
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from epic import aio
+from epic.models import Server, Profile, Gamble, Hunt
+from epic.query import insert_events
+
+
+class Command(BaseCommand):
+    help = (
+        "Write Gamble and Hunt rows the way the event buffer flushes them, through epic.aio and through the "
+        "ORM on the default database lane, and compare events per second. The rows written are deleted at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=5, help="how long to run each path for each batch size")
+        parser.add_argument("--flushers", type=int, default=4, help="concurrent flushes")
+        parser.add_argument("--batch", type=int, nargs="+", default=[1, 50, 500], help="events per flush")
+        parser.add_argument("--profiles", type=int, default=50)
+
+    def handle(self, *args, **options):
+        try:
+            aio.backend()
+        except ImproperlyConfigured as e:
+            raise CommandError(e)
+        random.seed(0)
+        server = Server.objects.create(
+            id=(Server.objects.order_by("-id").values_list("id", flat=True).first() or 0) + 1, name="benchmark"
+        )
+        profiles = [
+            Profile.objects.create(uid=f"benchmark-{i}", server=server, channel=0, notify=True)
+            for i in range(options["profiles"])
+        ]
+        sys.stdout.write(f"{'path':>6} {'batch':>6} {'events':>8} {'events/s':>10} {'p50':>8} {'p99':>8}\n")
+        try:
+            asyncio.run(self.compare(profiles, options["batch"], options["flushers"], options["seconds"]))
+        finally:
+            # events outlive their profile
+            for model_class in (Gamble, Hunt):
+                model_class.objects.filter(profile__in=profiles).delete()
+            Server.objects.filter(id=server.id).delete()
+        sys.stdout.write("Latencies are in ms per flush, with the flushes running concurrently.\n")
+
+    async def compare(self, profiles, batches, flushers, seconds):
+        try:
+            for batch in batches:
+                for label, write in (("orm", insert_events), ("aio", aio.insert_events)):
+                    events, timings = await self.run(write, profiles, batch, flushers, seconds)
+                    timings.sort()
+                    pct = lambda p: timings[min(len(timings) - 1, int(len(timings) * p))] * 1000 if timings else 0.0
+                    sys.stdout.write(
+                        f"{label:>6} {batch:>6} {events:>8} {events / seconds:>10,.0f} "
+                        f"{pct(0.5):>8.1f} {pct(0.99):>8.1f}\n"
+                    )
+                    sys.stdout.flush()
+        finally:
+            await aio.close()
+
+    @staticmethod
+    async def run(write, profiles, batch, flushers, seconds):
+        """`(events, timings)` after `flushers` coroutines have called `write` with `batch` events for `seconds`."""
+        deadline = time.monotonic() + seconds
+        events, timings = 0, []
+
+        async def flush():
+            nonlocal events
+            while time.monotonic() < deadline:
+                instances = [
+                    (
+                        Hunt(profile=random.choice(profiles), target="wolf", money=1, xp=1, loot="")
+                        if random.random() < 0.5
+                        else Gamble(profile=random.choice(profiles), game="bj", outcome="won", net=1)
+                    )
+                    for _ in range(batch)
+                ]
+                start = time.perf_counter()
+                await write(instances)
+                timings.append(time.perf_counter() - start)
+                events += batch
+
+        await asyncio.gather(*(flush() for _ in range(flushers)))
+        return events, timings
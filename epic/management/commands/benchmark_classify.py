@@ -0,0 +1,61 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from epic.classify import classify, guild_roster_regex, MESSAGE_KINDS
+from epic.models import Gamble
+from epic.management.commands.check_parsers import load_corpus, CORPUS
+
+
+class Command(BaseCommand):
+    help = (
+        "Time classify() per message over the golden corpus in epic/import, for ignored and relevant "
+        "messages, next to the chained substring checks process_rpg_messages used to run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--corpus", default=str(CORPUS))
+        parser.add_argument("--repeat", type=int, default=20_000, help="passes over each kind's messages")
+
+    def handle(self, *args, **options):
+        corpus = load_corpus(options["corpus"])
+        sys.stdout.write(f"{'kind':>18} {'messages':>9} {'classify':>9} {'chained':>8}\n")
+        kinds = sorted({kind for _, kind, _ in corpus}, key=lambda kind: (kind != MESSAGE_KINDS.IGNORE, kind))
+        for kind in kinds:
+            messages = [message for message, message_kind, _ in corpus if message_kind == kind]
+            timings = [self.time(options["repeat"], fn, messages) for fn in (classify, self.chained)]
+            sys.stdout.write(f"{kind:>18} {len(messages):>9} {timings[0]:>9.2f} {timings[1]:>8.2f}\n")
+        sys.stdout.write(
+            "Timings are the mean in µs per message, chained is the cue matching process_rpg_messages and "
+            "on_message_edit used to do, for reference.\n"
+        )
+
+    @staticmethod
+    def time(repeat, fn, messages):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for message in messages:
+                fn(message)
+        return (time.perf_counter() - start) * 1_000_000 / (repeat * len(messages))
+
+    @staticmethod
+    def chained(message):
+        rpg_cd_rd_cues, cooldown_cue = ["cooldowns", "ready"], "cooldown"
+        gambling_cues = set(Gamble.GAME_CUE_MAP.keys())
+        cues = [*rpg_cd_rd_cues, *gambling_cues, cooldown_cue]
+        if "found and killed" in message.content:
+            return MESSAGE_KINDS.HUNT
+        for embed in message.embeds:
+            if getattr(embed.author, "name", None) and any([cue in embed.author.name for cue in cues]):
+                if any([cue in embed.author.name for cue in rpg_cd_rd_cues]):
+                    return MESSAGE_KINDS.COOLDOWN_LIST
+                elif cooldown_cue in embed.author.name:
+                    return MESSAGE_KINDS.COOLDOWN_RESPONSE
+                elif any([cue in embed.author.name for cue in gambling_cues]):
+                    return MESSAGE_KINDS.GAMBLE
+        # on_message_edit
+        for embed in message.embeds:
+            if embed.fields and guild_roster_regex.match(embed.fields[0].name):
+                return MESSAGE_KINDS.GUILD_ROSTER
+        return MESSAGE_KINDS.IGNORE
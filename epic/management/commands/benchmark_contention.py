@@ -0,0 +1,116 @@
+import sys
+import time
+import random
+import datetime
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, OperationalError
+from django.test.utils import override_settings
+
+from epic.models import Server, Profile, CoolDown, Gamble, Hunt
+from epic.query import get_cooldown_messages, insert_events, sync_cooldowns
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the notifier loop and a message handler load against SQLite at the same time, first with stock "
+        "settings and then with SQLITE_TUNED, and compare latencies and lock errors. "
+        "The rows written are deleted at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=10)
+        parser.add_argument("--handlers", type=int, default=4, help="threads writing like on_message")
+        parser.add_argument("--profiles", type=int, default=50)
+        parser.add_argument("--interval", type=float, default=0.05, help="seconds between notifier runs")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("benchmark_contention only applies to USE_SQLITE deployments.")
+        random.seed(0)
+        server = Server.objects.create(
+            id=(Server.objects.order_by("-id").values_list("id", flat=True).first() or 0) + 1, name="benchmark"
+        )
+        profiles = [
+            Profile.objects.create(uid=f"benchmark-{i}", server=server, channel=0, notify=True)
+            for i in range(options["profiles"])
+        ]
+        sys.stdout.write(
+            f"{'mode':>6} {'role':>9} {'ops':>7} {'ops/s':>8} {'p50':>8} {'p99':>8} {'max':>8} {'locked':>7}\n"
+        )
+        try:
+            for tuned in (False, True):
+                with override_settings(SQLITE_TUNED=tuned):
+                    # journal_mode is stored in the database file, stock mode has to switch it back
+                    connection.close()
+                    if not tuned:
+                        with connection.cursor() as cursor:
+                            cursor.execute("PRAGMA journal_mode = DELETE")
+                    results = self.run(profiles, options["seconds"], options["handlers"], options["interval"])
+                    connection.close()
+                for role, (timings, locked) in results.items():
+                    timings.sort()
+                    ops = len(timings)
+                    pct = lambda p: timings[min(ops - 1, int(ops * p))] * 1000 if ops else 0.0
+                    sys.stdout.write(
+                        f"{'tuned' if tuned else 'stock':>6} {role:>9} {ops:>7} {ops / options['seconds']:>8.1f} "
+                        f"{pct(0.5):>8.1f} {pct(0.99):>8.1f} {pct(1):>8.1f} {locked:>7}\n"
+                    )
+                sys.stdout.flush()
+        finally:
+            # cascades to the profiles and everything they wrote
+            Server.objects.filter(id=server.id).delete()
+        sys.stdout.write(
+            "Latencies are in ms per notifier run or per handled message, locked counts 'database is locked' errors.\n"
+        )
+
+    @staticmethod
+    def run(profiles, seconds, handlers, interval):
+        """`{role: (timings, locked)}` after running the notifier and `handlers` message threads for `seconds`."""
+        deadline = time.monotonic() + seconds
+        results = {"notifier": ([], 0), "handler": ([], 0)}
+        lock = threading.Lock()
+
+        def loop(role, work, pause):
+            timings, locked = [], 0
+            try:
+                while time.monotonic() < deadline:
+                    start = time.perf_counter()
+                    try:
+                        work()
+                    except OperationalError as e:
+                        if "locked" not in str(e):
+                            raise
+                        locked += 1
+                    else:
+                        timings.append(time.perf_counter() - start)
+                    if pause:
+                        time.sleep(pause)
+            finally:
+                connection.close()
+                with lock:
+                    results[role] = (results[role][0] + timings, results[role][1] + locked)
+
+        def message():
+            # a hunt (or gamble) followed by the `rpg cd` that a player tends to send next
+            profile = random.choice(profiles)
+            now = datetime.datetime.now(tz=datetime.timezone.utc)
+            event = (
+                Hunt(profile=profile, target="wolf", money=1, xp=1, loot="")
+                if random.random() < 0.5
+                else Gamble(profile=profile, game="bj", outcome="won", net=1)
+            )
+            insert_events.__wrapped__([event])
+            # some cooldowns come due right away so the notifier has deletes to do
+            after = now + datetime.timedelta(seconds=random.choice((-1, 60)))
+            sync_cooldowns.__wrapped__([CoolDown(profile=profile, type="hunt", after=after)], [])
+
+        # the functions are called without their database lane, each thread gets its own connection
+        threads = [threading.Thread(target=loop, args=("notifier", get_cooldown_messages.__wrapped__, interval))]
+        threads += [threading.Thread(target=loop, args=("handler", message, 0)) for _ in range(handlers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
@@ -0,0 +1,98 @@
+import sys
+import time
+import random
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from epic.models import Server, Profile, CoolDown
+from epic.query import get_cooldown_messages, cooldown_message
+
+CD_TYPES = [cd_type for cd_type, _ in CoolDown.COOLDOWN_TYPE_CHOICES if cd_type != "guild"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time fetching and deleting due cooldowns against a growing cooldown table, next to the old query per "
+        "cooldown type. Everything is written in a transaction that is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[10_000, 100_000, 1_000_000])
+        parser.add_argument("--due", type=int, default=100, help="cooldowns that are due on every run")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        with transaction.atomic():
+            server = Server.objects.create(
+                id=(Server.objects.order_by("-id").values_list("id", flat=True).first() or 0) + 1, name="benchmark"
+            )
+            sys.stdout.write(f"{'rows':>10} {'due':>5} {'per type':>9} {'queries':>8} {'single':>8} {'queries':>8}\n")
+            rows = 0
+            for size in sorted(options["sizes"]):
+                rows += self.grow(server, rows, size - rows, options["due"])
+                timings = [
+                    self.time(options["repeat"], fn) for fn in (self.per_type, get_cooldown_messages.__wrapped__)
+                ]
+                sys.stdout.write(
+                    f"{rows:>10,} {timings[-1][2]:>5}"
+                    + "".join(f" {ms:>{w}.1f} {queries:>8}" for (ms, queries, _), w in zip(timings, (9, 8)))
+                    + "\n"
+                )
+                sys.stdout.flush()
+            transaction.set_rollback(True)
+        sys.stdout.write(
+            "Timings are the median in ms of fetching and deleting the due cooldowns, per type is the query per "
+            "cooldown type get_cooldown_messages used to run, for reference.\n"
+        )
+
+    @staticmethod
+    def time(repeat, fn):
+        """The median time in ms, the number of queries and the number of messages of `fn()`."""
+        timings = []
+        for _ in range(repeat):
+            # every run finds the same due cooldowns
+            with transaction.atomic(), CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                messages = fn()
+                timings.append((time.perf_counter() - start) * 1000)
+                transaction.set_rollback(True)
+        queries = [query for query in captured.captured_queries if "SAVEPOINT" not in query["sql"]]
+        return sorted(timings)[len(timings) // 2], len(queries), len(messages)
+
+    @staticmethod
+    def per_type():
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        messages, cleanup = [], []
+        for cd_type in CD_TYPES:
+            for _id, channel, uid in (
+                Profile.objects.command_type_enabled(cd_type)
+                .filter(cooldown__after__lte=now, cooldown__type=cd_type)
+                .values_list("cooldown__id", "channel", "uid")
+            ):
+                messages.append((cooldown_message(uid, cd_type), channel))
+                cleanup.append(_id)
+        CoolDown.objects.filter(id__in=cleanup).delete()
+        return messages
+
+    @staticmethod
+    def grow(server, rows, n, due):
+        """Adds profiles with a cooldown of every type until there are at least `n` more cooldowns, the first `due`
+        of all are due. Returns the number of cooldowns added."""
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        first = Profile.objects.filter(server=server).count()
+        profiles = Profile.objects.bulk_create(
+            Profile(uid=f"benchmark-{i}", server=server, channel=i % 50, notify=True)
+            for i in range(first, first + -(-n // len(CD_TYPES)))
+        )
+        cooldowns = []
+        for profile in profiles:
+            for cd_type in CD_TYPES:
+                # due ones are only added on the first call, the rest come due from an hour to a week out
+                offset = -random.random() if rows + len(cooldowns) < due else 1 + random.random() * 7 * 24
+                cooldowns.append(CoolDown(profile=profile, type=cd_type, after=now + datetime.timedelta(hours=offset)))
+        CoolDown.objects.bulk_create(cooldowns, batch_size=10_000)
+        return len(cooldowns)
@@ -0,0 +1,135 @@
+import sys
+import time
+import random
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.test.utils import CaptureQueriesContext
+
+from epic.models import Server, Profile, Gamble, Hunt, ROLLUPS
+
+TARGETS = ("wolf", "slime", "goblin", "zombie", "mermaid", "ghost", "baby dragon")
+LOOT = ("", "", "", "wolf skin", "zombie eye", "unicorn horn", "common lootbox", "rare lootbox")
+
+
+class Command(BaseCommand):
+    help = (
+        "Time windowed hunt, drop and gambling stats against a growing synthetic history. "
+        "Everything is written in a transaction that is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[10_000, 100_000, 1_000_000])
+        parser.add_argument("--minutes", nargs="+", type=int, default=[0, 5, 60, 1440], help="0 for lifetime stats")
+        # history grows further into the past at a steady rate, like it does on a live server
+        parser.add_argument("--rate", type=int, default=300, help="hunts (and gambles) per hour")
+        parser.add_argument("--profiles", type=int, default=20)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        with transaction.atomic():
+            server = Server.objects.create(
+                id=(Server.objects.order_by("-id").values_list("id", flat=True).first() or 0) + 1, name="benchmark"
+            )
+            profiles = [
+                Profile.objects.create(uid=f"benchmark-{i}", server=server, channel=0)
+                for i in range(options["profiles"])
+            ]
+            sys.stdout.write(
+                f"{'rows':>10} {'minutes':>8} {'raw hunts':>10} {'hunts':>8} {'drops':>8} {'raw gambles':>12} {'gambling':>9} "
+                f"{'queries':>8}\n"
+            )
+            rows = 0
+            for size in sorted(options["sizes"]):
+                self.grow(profiles, rows, size - rows, options["rate"])
+                rows = size
+                for minutes in options["minutes"]:
+                    fns = (
+                        self.raw_hunts,
+                        Hunt.objects.hunt_stats,
+                        Hunt.objects.drop_stats,
+                        self.raw_gambles,
+                        Gamble.objects.stats,
+                    )
+                    timings = [self.time(options["repeat"], fn, profiles[0].uid, minutes, server.id) for fn in fns]
+                    sys.stdout.write(
+                        f"{size:>10,} {minutes or 'all':>8}"
+                        + "".join(f" {ms:>{w}.1f}" for (ms, _), w in zip(timings, (10, 8, 8, 12, 9)))
+                        + f" {timings[-1][1]:>8}\n"
+                    )
+                    sys.stdout.flush()
+            transaction.set_rollback(True)
+        sys.stdout.write(
+            "Timings are the median in ms, the raw columns group the Hunt/Gamble rows in the window directly "
+            "for reference. Queries are per gambling stats call.\n"
+        )
+
+    @staticmethod
+    def time(repeat, fn, *args):
+        """The median time in ms and the number of queries of `fn(*args)`."""
+        timings = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                list(fn(*args))
+                timings.append((time.perf_counter() - start) * 1000)
+        return sorted(timings)[len(timings) // 2], len(queries)
+
+    @staticmethod
+    def raw_hunts(uid, minutes, server_id):
+        hunts = Hunt.objects.get_queryset().profile_hunts(uid, minutes, server_id)
+        return hunts.values("target").order_by("target").annotate(hunted=Count("id"), xp=Sum("xp"))
+
+    @staticmethod
+    def raw_gambles(uid, minutes, server_id):
+        gambles = Gamble.objects.filter(profile_id=uid, profile__server_id=server_id)
+        if minutes:
+            after = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(minutes=minutes)
+            gambles = gambles.filter(created__gt=after)
+        return gambles.values("game").order_by("game").annotate(total=Sum("net"), played=Count("id"))
+
+    @staticmethod
+    def grow(profiles, rows, n, rate):
+        """Adds `n` hunts and `n` gambles from before the `rows` already there, along with their rollups."""
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        for offset in range(rows, rows + n, 10_000):
+            hunts, gambles = [], []
+            for i in range(offset, min(offset + 10_000, rows + n)):
+                created = now - datetime.timedelta(hours=(i + random.random()) / rate)
+                hunts.append(
+                    Hunt(
+                        profile=random.choice(profiles),
+                        target=random.choice(TARGETS),
+                        money=random.randint(1, 5000),
+                        xp=random.randint(1, 5000),
+                        loot=random.choice(LOOT),
+                        created=created,
+                        updated=created,
+                    )
+                )
+                outcome = random.choice(("won", "lost", "tied"))
+                net = 0 if outcome == "tied" else random.randint(1, 100_000) * (-1 if outcome == "lost" else 1)
+                gambles.append(
+                    Gamble(
+                        profile=random.choice(profiles),
+                        game=random.choice(("bj", "cf", "slots", "dice")),
+                        outcome=outcome,
+                        net=net,
+                        created=created,
+                    )
+                )
+            # bulk_create would stamp auto_now(_add) fields with the current time
+            with connection.cursor() as cursor:
+                for objs in (hunts, gambles):
+                    fields = [f for f in objs[0]._meta.concrete_fields if not f.auto_created]
+                    cursor.executemany(
+                        f"INSERT INTO {connection.ops.quote_name(objs[0]._meta.db_table)} "
+                        f"({', '.join(connection.ops.quote_name(f.column) for f in fields)}) "
+                        f"VALUES ({', '.join(['%s'] * len(fields))})",
+                        [[f.get_db_prep_save(getattr(obj, f.attname), connection) for f in fields] for obj in objs],
+                    )
+            for rollup in ROLLUPS:
+                rollup.apply({Hunt: hunts, Gamble: gambles}[rollup.SOURCE])
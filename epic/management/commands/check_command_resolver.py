@@ -0,0 +1,94 @@
+import sys
+import time
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from epic.models import CoolDown
+from epic.utils import tokenize
+
+ARGS = ("", "lootbox", "common lootbox", "quest", "training", "breeding", "race", "arena", "join", "raid", "me", "123")
+NOISE = ("hello", "rpg", "cd", "inv", "p", "buy", "x", "'", '"', "\\", "\t", "\n")
+
+
+class Command(BaseCommand):
+    help = (
+        "Check CoolDown.resolve_command against the shlex based resolution it replaced on a seeded corpus of "
+        "rpg commands, and compare their speed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=20_000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        corpus = self.corpus(options["size"], options["seed"])
+        differences = 0
+        for cmd in corpus:
+            expected, got = self.outcome(self.shlex_resolve, cmd), self.outcome(CoolDown.resolve_command, cmd)
+            if expected != got:
+                differences += 1
+                sys.stdout.write(f"{cmd!r}: expected {expected!r}, got {got!r}\n")
+        sys.stdout.write(f"{len(corpus):,} commands, {differences} differences\n")
+        # quotes and backslashes still go through shlex
+        plain = [cmd for cmd in corpus if not any(c in cmd for c in "'\"\\")]
+        for label, cmds in (("all", corpus), ("unquoted", plain)):
+            timings = [self.time(options["repeat"], fn, cmds) for fn in (self.shlex_resolve, CoolDown.resolve_command)]
+            sys.stdout.write(
+                f"{label:>8} {len(cmds):>7,}: shlex {timings[0]:.2f}µs, compiled {timings[1]:.2f}µs per command, "
+                f"{timings[0] / timings[1]:.1f}x faster\n"
+            )
+        if differences:
+            raise CommandError(f"{differences} commands resolve differently")
+
+    @staticmethod
+    def corpus(size, seed):
+        """Every command name on its own, then `size` random variations of them with arguments, case, whitespace,
+        quoting and noise mixed in."""
+        rng = random.Random(seed)
+        names = list(CoolDown.COMMAND_RESOLUTION_MAP)
+        corpus = [f" {name}" for name in names]
+        for _ in range(size):
+            name = rng.choice(names)
+            if " " in name or rng.random() < 0.05:
+                name = f"{rng.choice(['', chr(39), chr(34)])}{name}{rng.choice(['', chr(39), chr(34)])}"
+            words = [name, *rng.sample(ARGS, rng.randint(0, 2))]
+            if rng.random() < 0.2:
+                words.insert(rng.randint(0, len(words)), rng.choice(NOISE))
+            cmd = "".join(f"{rng.choice([' ', '  ', chr(9)])}{word}" for word in words)
+            corpus.append(cmd.upper() if rng.random() < 0.1 else cmd)
+        return corpus
+
+    @staticmethod
+    def outcome(fn, cmd):
+        try:
+            return fn(cmd)
+        except ValueError as e:
+            # shlex refuses unbalanced quotes, both have to
+            return f"ValueError: {e}"
+
+    @staticmethod
+    def time(repeat, fn, corpus):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for cmd in corpus:
+                try:
+                    fn(cmd)
+                except ValueError:
+                    pass
+            timings.append((time.perf_counter() - start) * 1_000_000 / len(corpus))
+        return sorted(timings)[len(timings) // 2]
+
+    @staticmethod
+    def shlex_resolve(cmd):
+        """How `CoolDown.cd_from_command` resolved the cooldown type before `resolve_command`."""
+        tokens = tokenize(cmd)
+        if not tokens:
+            return None
+        # zero argument commands will just return whether or not the command matched
+        if len(tokens) == 1:
+            return CoolDown.COMMAND_RESOLUTION_MAP.get(tokens[0], lambda x: None)("")
+        cmd, *args = tokens
+        return CoolDown.COMMAND_RESOLUTION_MAP.get(cmd, lambda x: None)(" ".join(args))
@@ -0,0 +1,98 @@
+import sys
+import json
+import time
+import datetime
+
+from pathlib import Path
+from types import SimpleNamespace
+
+import discord
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from epic.classify import classify, MESSAGE_KINDS
+from epic.models import CoolDown
+from epic.parsers import parse_cooldown_list, parse_cooldown_response, parse_gamble, parse_hunt
+
+CORPUS = Path(settings.BASE_DIR) / "epic" / "import" / "golden_corpus.json"
+# cooldown times in the corpus are stored as seconds from this
+NOW = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def load_corpus(path=CORPUS):
+    """
+    `(message, kind, expected)` for each line of a corpus in the `rcd scrape` format, with
+    the kind and the parse results the message is expected to give added to every line.
+    """
+    corpus = []
+    with open(path) as lines:
+        for line in lines:
+            data = json.loads(line)
+            embeds = [
+                discord.Embed.from_dict({key: value for key, value in embed.items() if value is not None})
+                for embed in data["embeds"]
+            ]
+            corpus.append((SimpleNamespace(content=data["content"], embeds=embeds), data["kind"], data["expected"]))
+    return corpus
+
+
+def parse(kind, message):
+    """What the bot would parse out of `message`, in the same shape as the corpus' expectations."""
+    embed = message.embeds[0] if message.embeds else None
+    if kind == MESSAGE_KINDS.COOLDOWN_LIST:
+        updates, evictions = parse_cooldown_list([field.value for field in embed.fields], now=NOW)
+        return {"updates": [[cd.type, (cd.after - NOW).total_seconds()] for cd in updates], "evictions": evictions}
+    if kind == MESSAGE_KINDS.COOLDOWN_RESPONSE:
+        for cue, cooldown_type in CoolDown.COOLDOWN_RESPONSE_CUE_MAP.items():
+            if cue in str(embed.title):
+                cooldowns = parse_cooldown_response(embed.title, cooldown_type, now=NOW)
+                return [[cd.type, (cd.after - NOW).total_seconds()] for cd in cooldowns]
+        return []
+    if kind == MESSAGE_KINDS.GAMBLE:
+        gamble = parse_gamble(embed)
+        return list(gamble) if gamble else None
+    if kind == MESSAGE_KINDS.HUNT:
+        hunt = parse_hunt(message.content)
+        return list(hunt) if hunt else None
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Check the classifier and the embed parsers against the golden corpus in epic/import, "
+        "then report parses per second for each kind of message."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--corpus", default=str(CORPUS))
+        parser.add_argument("--seconds", type=float, default=1, help="how long to time each kind")
+
+    def handle(self, *args, **options):
+        corpus = load_corpus(options["corpus"])
+        differences = 0
+        for i, (message, kind, expected) in enumerate(corpus, 1):
+            classified, _ = classify(message)
+            got = parse(kind, message)
+            if classified != kind or got != expected:
+                differences += 1
+                sys.stdout.write(f"line {i}: expected {kind} {expected!r}, got {classified} {got!r}\n")
+        sys.stdout.write(f"{len(corpus)} messages, {differences} differences\n\n")
+        sys.stdout.write(f"{'kind':>18} {'messages':>9} {'parses/s':>10}\n")
+        for kind in (
+            MESSAGE_KINDS.COOLDOWN_LIST,
+            MESSAGE_KINDS.COOLDOWN_RESPONSE,
+            MESSAGE_KINDS.GAMBLE,
+            MESSAGE_KINDS.HUNT,
+        ):
+            messages = [message for message, message_kind, _ in corpus if message_kind == kind]
+            parses, deadline = 0, time.perf_counter() + options["seconds"]
+            start = time.perf_counter()
+            while time.perf_counter() < deadline:
+                for message in messages:
+                    parse(kind, message)
+                parses += len(messages)
+            sys.stdout.write(f"{kind:>18} {len(messages):>9} {parses / (time.perf_counter() - start):>10,.0f}\n")
+        sys.stdout.flush()
+        if differences:
+            raise CommandError(f"{differences} messages differ from the golden corpus")
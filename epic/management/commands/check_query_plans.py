@@ -0,0 +1,126 @@
+import re
+import sys
+import datetime
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from epic import aio
+from epic.cache import CooldownViewCache
+from epic.models import Server, Profile, Guild, CoolDown, Gamble, Hunt
+from epic.query import (
+    get_cooldown_messages,
+    get_guild_cooldown_messages,
+    cleanup_old_cooldowns,
+    sync_cooldowns,
+    set_guild_cd,
+    set_guild_membership,
+    insert_events,
+)
+
+# "SCAN epic_cooldown" and "SCAN TABLE epic_cooldown" (SQLite), "Seq Scan on epic_cooldown" (Postgres)
+full_scan_regex = re.compile(r"\b(?:SCAN(?: TABLE)?|Seq Scan on) (?P<table>\w+)")
+executemany_regex = re.compile(r"^(?P<times>\d+) times: ")
+STATEMENTS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN every query the bot's hot paths run and fail if any of them falls back to a full table scan. "
+        "The paths run against a small fixture in a transaction that is rolled back at the end."
+    )
+
+    def handle(self, *args, **options):
+        tables = {model._meta.db_table for model in apps.get_app_config("epic").get_models()}
+        failures = []
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                # the planner prefers sequential scans on tables this small whatever the indexes
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            fixture = self.fixture()
+            for name, path in self.hot_paths(**fixture):
+                with CaptureQueriesContext(connection) as captured:
+                    path()
+                for query in captured.captured_queries:
+                    scans = self.full_scans(query["sql"], tables)
+                    status = "FULL SCAN " + ", ".join(scans) if scans else "ok"
+                    sys.stdout.write(f"{name:<28} {status:<28} {query['sql'][:100]}\n")
+                    if scans:
+                        failures.append(name)
+            transaction.set_rollback(True)
+        sys.stdout.flush()
+        if failures:
+            raise CommandError(f"Full table scans in: {', '.join(sorted(set(failures)))}")
+
+    @staticmethod
+    def full_scans(sql, tables):
+        params = None
+        times = executemany_regex.match(sql)
+        if times:
+            # executemany is logged with its placeholders, any value will do for the plan
+            sql = sql[times.end() :]
+            params = [None] * sql.count("%s")
+        if not sql.lstrip().upper().startswith(STATEMENTS):
+            return []
+        explain = "EXPLAIN QUERY PLAN " if connection.vendor == "sqlite" else "EXPLAIN "
+        with connection.cursor() as cursor:
+            cursor.execute(explain + sql, params)
+            plan = "\n".join(str(row[-1]) for row in cursor.fetchall())
+        return [match.group("table") for match in full_scan_regex.finditer(plan) if match.group("table") in tables]
+
+    @staticmethod
+    def fixture():
+        """A profile in a guild with a due raid and a due cooldown, so every path has a row to find."""
+        due = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(minutes=1)
+        server = Server.objects.create(
+            id=(Server.objects.order_by("-id").values_list("id", flat=True).first() or 0) + 1, name="plans"
+        )
+        guild = Guild.objects.create(name="plans-guild", after=due)
+        profile = Profile.objects.create(uid="plans-0", server=server, channel=0, player_guild=guild, notify=True)
+        CoolDown.objects.create(profile=profile, type="hunt", after=due)
+        return {"server": server, "profile": profile}
+
+    @staticmethod
+    def hot_paths(server, profile):
+        """`(name, callable)` for each hot path. Loading the readiness index and the scheduler at startup read
+        whole tables on purpose and are left out."""
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+
+        def stats(uid, minutes):
+            Gamble.objects.stats(uid, minutes, server.id)
+            list(Hunt.objects.hunt_stats(uid, minutes, server.id))
+            Hunt.objects.drop_stats(uid, minutes, server.id)
+
+        # the ORM paths are called without their database lane so they run on this connection
+        return (
+            (
+                "ingest gambles and hunts",
+                lambda: insert_events.__wrapped__(
+                    [
+                        Gamble(profile=profile, game="bj", outcome="won", net=10),
+                        Hunt(profile=profile, target="wolf", money=1, xp=1, loot="wolf skin"),
+                    ]
+                ),
+            ),
+            (
+                "sync cooldowns",
+                lambda: sync_cooldowns.__wrapped__(
+                    [CoolDown(profile=profile, type="daily", after=now + datetime.timedelta(hours=1))],
+                    [{"profile_id": profile.uid, "type": "weekly"}],
+                ),
+            ),
+            ("cd view", lambda: CooldownViewCache._build(profile)),
+            ("due cooldowns", get_cooldown_messages.__wrapped__),
+            ("due cooldowns (ASYNC_DB)", lambda: connection.cursor().execute(aio._due_cooldowns_sql(), [now])),
+            ("due guild raids", get_guild_cooldown_messages.__wrapped__),
+            ("guild cd", lambda: set_guild_cd.__wrapped__(profile)),
+            ("guild membership", lambda: set_guild_membership.__wrapped__({"plans-guild": [profile.uid]})),
+            ("cleanup cooldowns", cleanup_old_cooldowns.__wrapped__),
+            ("lifetime stats", lambda: stats(profile.uid, None)),
+            ("windowed stats", lambda: stats(profile.uid, 90)),
+            ("server lifetime stats", lambda: stats(None, None)),
+            ("server windowed stats", lambda: stats(None, 90)),
+        )
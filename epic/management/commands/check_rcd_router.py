@@ -0,0 +1,147 @@
+import re
+import sys
+import json
+import asyncio
+import datetime
+
+from pathlib import Path
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from epic.cmd_chain import handle_rpcd_message
+from epic.db import lanes
+from epic.models import Server, Profile, JoinCode, Guild
+from epic.query import set_guild_membership
+from epic.utils import tokenize
+
+INVOCATIONS = Path(settings.BASE_DIR) / "epic" / "import" / "rcd_invocations.json"
+# the invocations run in a registered and an unregistered guild, always by the same author
+REGISTERED, UNREGISTERED, AUTHOR = 1, 2, 10
+MENTIONED, GUILD, JOIN_CODE = 99, "rcd-check", "abc"
+# replies contain the current time, and the "too long" time format error shows a function
+time_regex = re.compile(r"\d{1,2}:\d\d(:\d\d)?( [AP]M)?(, \d\d/\d\d)?|\d{4}-\d\d-\d\d \d\d:\d\d:\d\d")
+address_regex = re.compile(r" at 0x[0-9a-f]+")
+
+
+class Client:
+    def get_user(self, user_id):
+        return SimpleNamespace(id=user_id, name=f"user{user_id}")
+
+
+def message(content, guild_id):
+    guild = SimpleNamespace(id=guild_id, name=f"srv{guild_id}")
+    return SimpleNamespace(
+        content=content, author=SimpleNamespace(id=AUTHOR, name="bob"), channel=SimpleNamespace(id=5, guild=guild)
+    )
+
+
+def setup():
+    Server.objects.create(id=REGISTERED, name="srv")
+    JoinCode.objects.create(code=JOIN_CODE)
+    Guild.objects.create(name=GUILD, after=datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc))
+
+
+def teardown():
+    # cascades to the profiles
+    Server.objects.filter(id__in=[REGISTERED, UNREGISTERED]).delete()
+    JoinCode.objects.filter(code=JOIN_CODE).delete()
+    Guild.objects.filter(name=GUILD).delete()
+
+
+def existing():
+    """Fixture rows that are already in the database, which the check would overwrite and delete."""
+    return [
+        *(
+            f"server {pk}"
+            for pk in Server.objects.filter(id__in=[REGISTERED, UNREGISTERED]).values_list("id", flat=True)
+        ),
+        *(
+            f"profile {uid}"
+            for uid in Profile.objects.filter(uid__in=[AUTHOR, MENTIONED]).values_list("uid", flat=True)
+        ),
+        *(f"join code {code}" for code in JoinCode.objects.filter(code=JOIN_CODE).values_list("code", flat=True)),
+        *(f"guild {name}" for name in Guild.objects.filter(name=GUILD).values_list("name", flat=True)),
+    ]
+
+
+def snapshot():
+    """Everything the invocations can change, as JSON."""
+    profiles = {}
+    for profile in Profile.objects.filter(uid__in=[AUTHOR, MENTIONED]).order_by("uid"):
+        profiles[profile.uid] = {
+            field.attname: getattr(profile, field.attname)
+            for field in Profile._meta.concrete_fields
+            if field.name not in {"uid", "created", "updated"}
+        }
+    return {
+        "profiles": profiles,
+        "servers": {
+            str(pk): name
+            for pk, name in Server.objects.filter(id__in=[REGISTERED, UNREGISTERED]).values_list("id", "name")
+        },
+        "join_codes": dict(JoinCode.objects.filter(code=JOIN_CODE).values_list("code", "claimed")),
+        "guilds": dict(Guild.objects.filter(name=GUILD).values_list("name", "raid_dibbs_id")),
+    }
+
+
+async def invoke(content, guild_id, handle=handle_rpcd_message):
+    """The reply to `content` the way on_message would get it, as JSON."""
+    server = await lanes["default"].run(lambda: Server.objects.filter(id=guild_id).first())
+    try:
+        reply = await handle(Client(), tokenize(content[3:]), message(content, guild_id), server)
+    except Exception as e:
+        # a few invocations have always crashed, they should keep crashing the same way
+        return {"exception": type(e).__name__}
+    return json.loads(address_regex.sub("", time_regex.sub("<time>", json.dumps(reply.to_embed().to_dict()))))
+
+
+async def replay(steps, handle=handle_rpcd_message):
+    """`(step, reply, state)` for every step, `reply` is None for roster steps."""
+    results = []
+    for step in steps:
+        if "roster" in step:
+            await set_guild_membership(step["roster"])
+            reply = None
+        else:
+            reply = await invoke(step["content"], step["guild"], handle)
+        results.append((step, reply, await lanes["default"].run(snapshot)))
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the documented rcd invocations in epic/import against the command router, in a registered and "
+        "an unregistered guild, and check the replies and the database state after each of them. "
+        "The rows written are deleted at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--invocations", default=str(INVOCATIONS))
+
+    def handle(self, *args, **options):
+        with open(options["invocations"]) as lines:
+            steps = [json.loads(line) for line in lines]
+        rows = existing()
+        if rows:
+            raise CommandError(f"check_rcd_router needs these rows for itself: {', '.join(rows)}")
+        setup()
+        try:
+            results = asyncio.run(replay(steps))
+        finally:
+            teardown()
+        differences, expected_state = 0, None
+        for i, (step, reply, state) in enumerate(results, 1):
+            # the state is only recorded when a step changes it
+            expected_state = step.get("state", expected_state)
+            label = json.dumps(step["roster"]) if "roster" in step else f"{step['content']} (guild {step['guild']})"
+            if reply != step.get("reply"):
+                differences += 1
+                sys.stdout.write(f"line {i} {label}: expected {step.get('reply')!r}, got {reply!r}\n")
+            if state != expected_state:
+                differences += 1
+                sys.stdout.write(f"line {i} {label}: expected state {expected_state!r}, got {state!r}\n")
+        sys.stdout.write(f"{len(steps)} invocations, {differences} differences\n")
+        if differences:
+            raise CommandError(f"{differences} differences from {options['invocations']}")
@@ -0,0 +1,14 @@
+import sys
+from django.core.management.base import BaseCommand
+
+from epic.models import ROLLUPS
+
+
+class Command(BaseCommand):
+    help = "Recompute the gambling and hunting rollups from the Gamble and Hunt tables"
+
+    def handle(self, *args, **options):
+        for rollup in ROLLUPS:
+            rows = rollup.rebuild()
+            sys.stdout.write(f"Rebuilt {len(rows)} {rollup._meta.verbose_name_plural}.\n")
+        sys.stdout.flush()
@@ -1,9 +1,65 @@
 import datetime
+import itertools
 
 from types import SimpleNamespace
 
 from django.db import models
 from django.db.models import Case, When, Max, Min, Sum, Count, F, Value, Q
+from django.db.models.functions import Coalesce
+
+from .mixins import TimeBucket
+
+# GambleRollup and GambleBucket counters summed up per game
+ROLLUP_TOTALS = {
+    "most": Max("big_win"),
+    "least": Min("big_loss"),
+    "total": Sum("net"),
+    "won": Sum("wins"),
+    "lost": Sum("losses"),
+    "tied": Sum("ties"),
+    "played": Sum("count"),
+}
+
+
+def window_buckets(minutes, now=None):
+    """
+    Splits the last `minutes` so that only the partial minute at the start of the window has to be
+    read from the raw rows, whatever the window is made of after that is covered by minute buckets
+    up to the first full hour and by hour buckets from there on.
+    Returns `(cutoff, first_minute, filter for the buckets)`, the raw rows are `cutoff < created < first_minute`.
+    """
+    now = now or datetime.datetime.now(tz=datetime.timezone.utc)
+    cutoff = now - datetime.timedelta(minutes=minutes)
+    first_minute = cutoff.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+    first_hour = cutoff.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+    window = Q(resolution=TimeBucket.MINUTE, start__gte=first_minute, start__lt=first_hour) | Q(
+        resolution=TimeBucket.HOUR, start__gte=first_hour
+    )
+    return cutoff, first_minute, window
+
+
+def _scoped(qs, profile_id, server_id):
+    if profile_id:
+        qs = qs.filter(profile_id=profile_id)
+    if server_id:
+        qs = qs.filter(profile__server_id=server_id)
+    return qs
+
+
+def _combine(rows, key, sums=(), greatest=(), least=()):
+    """Merges aggregated rows that share `key`, e.g. the raw edge of a window and its buckets, ordered by `key`."""
+    combined = {}
+    for row in rows:
+        current = combined.setdefault(row[key], row)
+        if current is row:
+            continue
+        for name in sums:
+            current[name] += row[name]
+        for name in greatest:
+            current[name] = max(current[name], row[name])
+        for name in least:
+            current[name] = min(current[name], row[name])
+    return [combined[k] for k in sorted(combined)]
 
 
 class ProfileManager(models.Manager):
@@ -19,105 +75,84 @@ class GamblingStatsManager(models.Manager):
         game_case = Case(
             When(game="bj", then=Value("blackjack")), When(game="cf", then=Value("coinflip")), default="game"
         )
-        qs = self.get_queryset()
-        if profile_uid:
-            qs = qs.filter(profile_id=profile_uid)
         if minutes:
-            after = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(minutes=minutes)
-            qs = qs.filter(created__gt=after)
-        if server_id:
-            qs = qs.filter(profile__server_id=server_id)
-        earnings = (
-            qs.values("game")
-            .order_by("game")
-            .annotate(
-                g=game_case,
-                big_win=Max(
-                    Case(
-                        When(net__gt=0, then="net"),
-                        default=0,
-                    )
-                ),
-                big_loss=Min(
-                    Case(
-                        When(net__lt=0, then="net"),
-                        default=0,
-                    )
-                ),
-                total=Sum("net"),
-            )
-        )
-        earnings_results = earnings.values("g", "big_win", "big_loss", "total")
-        if not earnings_results:
+            rows = self._windowed_totals(game_case, profile_uid, minutes, server_id)
+        else:
+            rows = self._lifetime_totals(game_case, profile_uid, server_id)
+        if not rows:
             return (("No Results", "No games could be found."),)
 
-        game_col_size, min_col_size = 15, 8
-        win_col_size = max(max([len(str(f"{r['big_win']:,}")) for r in earnings_results]), min_col_size)
-        loss_col_size = max(max([len(str(f"{r['big_loss']:,}")) for r in earnings_results]), min_col_size)
-        total_col_size = max(max([len(str(f"{r['total']:,}")) for r in earnings_results]), min_col_size)
-        biggest_net, lifetime = (
-            f"{'Game':<{game_col_size}}     {'Big Win':>{win_col_size}}  {'Big Loss':>{loss_col_size}}\n",
-            "",
+        # a single pass formats every cell and keeps track of the column widths and totals,
+        # the widths don't account for the totals
+        widths = {"most": 8, "least": 8, "total": 8, "won": 6, "lost": 6, "tied": 6, "played": 6}
+        totals = dict.fromkeys(widths, 0)
+        lines = []
+        for row in rows:
+            cells = {}
+            for column in widths:
+                cells[column] = f"{row[column]:,}"
+                widths[column] = max(widths[column], len(cells[column]))
+                totals[column] += row[column]
+            lines.append((row["g"], cells))
+        lines.append(("Total", {column: f"{total:,}" for column, total in totals.items()}))
+
+        w, game_col_size = widths, 15
+        games_played = [
+            f"{'Game':<{game_col_size}}     {'Wins':>{w['won']}}  {'Losses':>{w['lost']}}  {'Ties':>{w['tied']}}  {'Total':>{w['played']}}"
+        ]
+        biggest_net = [f"{'Game':<{game_col_size}}     {'Big Win':>{w['most']}}  {'Big Loss':>{w['least']}}"]
+        lifetime = []
+        for game, c in lines:
+            games_played.append(
+                f"{game:{game_col_size}} ==> {c['won']:>{w['won']}}  {c['lost']:>{w['lost']}}  {c['tied']:>{w['tied']}}  {c['played']:>{w['played']}}"
+            )
+            biggest_net.append(f"{game:{game_col_size}} ==> {c['most']:>{w['most']}}  {c['least']:>{w['least']}}")
+            lifetime.append(f"{game:{game_col_size}} ==> {c['total']:>{w['total']}}")
+        games_played, biggest_net, lifetime = ("\n".join(table) for table in (games_played, biggest_net, lifetime))
+        return (
+            ("Games Played", f"```\n{games_played}\n```"),
+            ("Biggest Net", f"```\n{biggest_net}\n```"),
+            ("Lifetime Winnins", f"```\n{lifetime}```"),
         )
-        t = SimpleNamespace(big_win=0, big_loss=0, total=0)
-        for game in earnings_results:
-            g = SimpleNamespace(**game)
-            biggest_net += f"{g.g:{game_col_size}} ==> {g.big_win:{win_col_size},}  {g.big_loss:{loss_col_size},}\n"
-            lifetime += f"{g.g:{game_col_size}} ==> {g.total:{total_col_size},}\n"
-            t.big_win, t.big_loss, t.total = t.big_win + g.big_win, t.big_loss + g.big_loss, t.total + g.total
-        biggest_net = f"```\n{biggest_net}{'Total':{game_col_size}} ==> {t.big_win:{win_col_size},}  {t.big_loss:{loss_col_size},}\n```"
-        lifetime = f"```\n{lifetime}{'Total':{game_col_size}} ==> {t.total:{total_col_size},}```"
-
-        games_played = (
-            qs.values("game")
-            .order_by("game")
+
+    def _windowed_totals(self, game_case, profile_uid, minutes, server_id):
+        # models imports this module
+        from .models import GambleBucket
+
+        cutoff, first_minute, window = window_buckets(minutes)
+        raw = _scoped(self.get_queryset(), profile_uid, server_id).filter(created__gt=cutoff, created__lt=first_minute)
+        raw = (
+            raw.values("game")
+            .order_by()
             .annotate(
                 g=game_case,
-                won=Sum(
-                    Case(
-                        When(outcome="won", then=1),
-                        default=0,
-                        output_field=models.IntegerField(),
-                    )
-                ),
-                lost=Sum(
-                    Case(
-                        When(outcome="lost", then=1),
-                        default=0,
-                        output_field=models.IntegerField(),
-                    )
-                ),
-                tied=Sum(
-                    Case(
-                        When(outcome="tied", then=1),
-                        default=0,
-                        output_field=models.IntegerField(),
-                    )
-                ),
-                total=Count("net"),
+                most=Max(Case(When(net__gt=0, then="net"), default=0)),
+                least=Min(Case(When(net__lt=0, then="net"), default=0)),
+                total=Sum("net"),
+                won=Sum(Case(When(outcome="won", then=1), default=0, output_field=models.IntegerField())),
+                lost=Sum(Case(When(outcome="lost", then=1), default=0, output_field=models.IntegerField())),
+                tied=Sum(Case(When(outcome="tied", then=1), default=0, output_field=models.IntegerField())),
+                played=Count("net"),
             )
         )
-        games_played_results = games_played.values("g", "won", "lost", "tied", "total")
-
-        game_col_size, min_col_size = 15, 6
-        win_col_size = max(max([len(str(f"{r['won']:,}")) for r in games_played_results]), min_col_size)
-        loss_col_size = max(max([len(str(f"{r['lost']:,}")) for r in games_played_results]), min_col_size)
-        tied_col_size = max(max([len(str(f"{r['tied']:,}")) for r in games_played_results]), min_col_size)
-        total_col_size = max(max([len(str(f"{r['total']:,}")) for r in games_played_results]), min_col_size)
-        t = SimpleNamespace(wins=0, losses=0, ties=0, total=0)
-        games_played = f"{'Game':<{game_col_size}}     {'Wins':>{win_col_size}}  {'Losses':>{loss_col_size}}  {'Ties':>{tied_col_size}}  {'Total':>{total_col_size}}\n"
-        for game in games_played_results:
-            g = SimpleNamespace(**game)
-            games_played += f"{g.g:{game_col_size}} ==> {g.won:{win_col_size},}  {g.lost:{loss_col_size},}  {g.tied:{tied_col_size},}  {g.total:{total_col_size},}\n"
-            t.wins, t.losses, t.ties, t.total = t.wins + g.won, t.losses + g.lost, t.ties + g.tied, t.total + g.total
-        games_played = f"```\n{games_played}{'Total':{game_col_size}} ==> {t.wins:{win_col_size},}  {t.losses:{loss_col_size},}  {t.ties:{tied_col_size},}  {t.total:{total_col_size},}\n```"
-
-        return (
-            ("Games Played", games_played),
-            ("Biggest Net", biggest_net),
-            ("Lifetime Winnins", lifetime),
+        buckets = _scoped(GambleBucket.objects.filter(window), profile_uid, server_id)
+        buckets = buckets.values("game").order_by().annotate(g=game_case, **ROLLUP_TOTALS)
+        # both halves in one round trip, merged per game here
+        return _combine(
+            raw.union(buckets, all=True),
+            "game",
+            sums=("total", "won", "lost", "tied", "played"),
+            greatest=("most",),
+            least=("least",),
         )
 
+    def _lifetime_totals(self, game_case, profile_uid, server_id):
+        # models imports this module
+        from .models import GambleRollup
+
+        rollups = _scoped(GambleRollup.objects.all(), profile_uid, server_id)
+        return list(rollups.values("game").order_by("game").annotate(g=game_case, **ROLLUP_TOTALS))
+
 
 class HuntQuerySet(models.QuerySet):
     def profile_hunts(self, profile_id=None, minutes=None, server_id=None):
@@ -138,18 +173,44 @@ class HuntManager(models.Manager):
     def open_hunts(self, profile_ids):
         return self.get_queryset().filter(target__isnull=True, profile_id__in=profile_ids)
 
+    def _bucketed(self, profile_id, minutes, server_id):
+        """
+        Where the hunts in the window (or all of them) are counted, as `(raw, buckets)`: the Hunt rows
+        in the partial minute at the start of the window and the HuntBuckets that cover the rest.
+        """
+        # models imports this module
+        from .models import HuntBucket
+
+        buckets = _scoped(HuntBucket.objects.all(), profile_id, server_id)
+        if not minutes:
+            return self.none(), buckets.filter(resolution=TimeBucket.HOUR)
+        cutoff, first_minute, window = window_buckets(minutes)
+        raw = self.get_queryset().profile_hunts(profile_id, None, server_id)
+        # hunts that were never closed aren't counted
+        raw = raw.filter(target__isnull=False, created__gt=cutoff, created__lt=first_minute)
+        return raw, buckets.filter(window)
+
     def hunt_stats(self, profile_id=None, minutes=None, server_id=None):
-        qs = self.get_queryset().profile_hunts(profile_id, minutes, server_id)
-        lifetime_hunts = (
-            qs.values("target")
-            .order_by("target")
+        raw, buckets = self._bucketed(profile_id, minutes, server_id)
+        raw = (
+            raw.values("target")
+            .order_by()
             .annotate(
                 hunted=Count("id"),
-                xp=Sum("xp"),
-                drops=Sum(Case(When(loot="", then=0), default=1, output_field=models.IntegerField())),
+                xp=Coalesce(Sum("xp"), 0),
+                drops=Sum(
+                    Case(When(Q(loot="") | Q(loot__isnull=True), then=0), default=1, output_field=models.IntegerField())
+                ),
             )
-            .order_by("-hunted", "-drops")
         )
+        buckets = (
+            {"target": b["target"], "hunted": b["_hunted"], "xp": b["_xp"], "drops": b["_drops"]}
+            for b in buckets.values("target")
+            .order_by()
+            .annotate(_hunted=Sum("hunted"), _xp=Sum("xp"), _drops=Sum(Case(When(loot="", then=0), default="hunted")))
+        )
+        lifetime_hunts = _combine(itertools.chain(raw, buckets), "target", sums=("hunted", "xp", "drops"))
+        lifetime_hunts.sort(key=lambda h: (-h["hunted"], -h["drops"]))
         if not lifetime_hunts:
             return (("No Results", "No hunts could be found."),)
 
@@ -182,17 +243,14 @@ class HuntManager(models.Manager):
         return ((f"Hunt Statistics {i+1}", f"```\n{lifetime}```") for i, lifetime in enumerate(lifetime_pages))
 
     def drop_stats(self, profile_id=None, minutes=None, server_id=None):
-        qs = self.get_queryset().profile_hunts(profile_id, minutes, server_id)
-        lifetime_drops = (
-            qs.exclude(Q(loot__isnull=True) | Q(loot=""))
-            .values("loot")
-            .order_by("loot")
-            .annotate(
-                dropped=Count("id"),
-                sort=Case(When(loot__contains="lootbox", then=1), default=0, output_field=models.IntegerField()),
-            )
-            .order_by("-sort", "-dropped")
+        raw, buckets = self._bucketed(profile_id, minutes, server_id)
+        raw = raw.exclude(Q(loot__isnull=True) | Q(loot="")).values("loot").order_by().annotate(dropped=Count("id"))
+        buckets = (
+            {"loot": b["loot"], "dropped": b["_dropped"]}
+            for b in buckets.exclude(loot="").values("loot").order_by().annotate(_dropped=Sum("hunted"))
         )
+        lifetime_drops = _combine(itertools.chain(raw, buckets), "loot", sums=("dropped",))
+        lifetime_drops.sort(key=lambda d: ("lootbox" not in d["loot"], -d["dropped"]))
         if not lifetime_drops:
             return (("No Results", "No drops could be found."),)
 
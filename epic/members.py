@@ -0,0 +1,77 @@
+class MemberIndex:
+    """
+    Indexes the members the gateway has told us about so that resolving a player from
+    EPIC RPG output doesn't scan every member of every guild. Keeps a per-guild
+    `name -> {user ids}` map and a global `(name, discriminator) -> user id` map.
+    """
+
+    def __init__(self):
+        self._by_name = {}
+        self._by_tag = {}
+        # user id -> (name, discriminator) and user id -> ids of the guilds they are indexed in
+        self._tags = {}
+        self._guilds = {}
+
+    def build(self, guilds):
+        self._by_name, self._by_tag, self._tags, self._guilds = {}, {}, {}, {}
+        for guild in guilds:
+            self.add_guild(guild)
+
+    def add_guild(self, guild):
+        for member in guild.members:
+            self.add(member)
+
+    def remove_guild(self, guild):
+        for member in guild.members:
+            self.remove(member)
+        self._by_name.pop(guild.id, None)
+
+    def add(self, member):
+        # picks up name changes we may have missed while we are at it
+        self.rename(member)
+        guild_id, user_id = member.guild.id, member.id
+        self._tags[user_id] = tag = (member.name, member.discriminator)
+        self._by_tag[tag] = user_id
+        self._guilds.setdefault(user_id, set()).add(guild_id)
+        self._by_name.setdefault(guild_id, {}).setdefault(member.name, set()).add(user_id)
+
+    def remove(self, member):
+        guild_id, user_id = member.guild.id, member.id
+        guilds = self._guilds.get(user_id)
+        if not guilds or guild_id not in guilds:
+            return
+        self._discard_name(guild_id, self._tags[user_id][0], user_id)
+        guilds.discard(guild_id)
+        if not guilds:
+            del self._guilds[user_id]
+            tag = self._tags.pop(user_id)
+            if self._by_tag.get(tag) == user_id:
+                del self._by_tag[tag]
+
+    def rename(self, user):
+        """A user changed their name or discriminator, which applies to every guild they are in."""
+        old_tag, new_tag = self._tags.get(user.id), (user.name, user.discriminator)
+        if old_tag is None or old_tag == new_tag:
+            return
+        for guild_id in self._guilds[user.id]:
+            self._discard_name(guild_id, old_tag[0], user.id)
+            self._by_name[guild_id].setdefault(user.name, set()).add(user.id)
+        if self._by_tag.get(old_tag) == user.id:
+            del self._by_tag[old_tag]
+        self._tags[user.id] = new_tag
+        self._by_tag[new_tag] = user.id
+
+    def ids_by_name(self, guild_id, name):
+        return self._by_name.get(guild_id, {}).get(name, set())
+
+    def id_by_tag(self, name, discriminator):
+        return self._by_tag.get((name, discriminator))
+
+    def _discard_name(self, guild_id, name, user_id):
+        names = self._by_name[guild_id]
+        names[name].discard(user_id)
+        if not names[name]:
+            del names[name]
+
+
+member_index = MemberIndex()
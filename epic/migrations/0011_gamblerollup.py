@@ -0,0 +1,68 @@
+# Generated by Django 3.1.3 on 2026-10-18 03:15
+
+from django.db import migrations, models
+from django.db.models import Case, When, Max, Min, Sum, Count
+import django.db.models.deletion
+
+
+def populate_rollups(apps, schema_editor):
+    Gamble = apps.get_model('epic', 'Gamble')
+    GambleRollup = apps.get_model('epic', 'GambleRollup')
+    outcome_count = lambda outcome: Sum(Case(When(outcome=outcome, then=1), default=0, output_field=models.IntegerField()))
+    totals = (
+        Gamble.objects.filter(profile__isnull=False)
+        .values('profile_id', 'game')
+        .order_by('profile_id', 'game')
+        .annotate(
+            wins=outcome_count('won'),
+            losses=outcome_count('lost'),
+            ties=outcome_count('tied'),
+            played=Count('id'),
+            total=Sum('net'),
+            most=Max(Case(When(net__gt=0, then='net'), default=0)),
+            least=Min(Case(When(net__lt=0, then='net'), default=0)),
+        )
+    )
+    GambleRollup.objects.bulk_create(
+        GambleRollup(
+            profile_id=t['profile_id'],
+            game=t['game'],
+            wins=t['wins'],
+            losses=t['losses'],
+            ties=t['ties'],
+            count=t['played'],
+            net=t['total'],
+            big_win=t['most'],
+            big_loss=t['least'],
+        )
+        for t in totals
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('epic', '0010_hunt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GambleRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('game', models.CharField(choices=[('bj', 'Blackjack'), ('cf', 'Coinflip'), ('slots', 'Slots'), ('dice', 'Dice')], max_length=5)),
+                ('wins', models.PositiveIntegerField(default=0)),
+                ('losses', models.PositiveIntegerField(default=0)),
+                ('ties', models.PositiveIntegerField(default=0)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('net', models.BigIntegerField(default=0)),
+                ('big_win', models.BigIntegerField(default=0)),
+                ('big_loss', models.BigIntegerField(default=0)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gamble_rollups', to='epic.profile')),
+            ],
+            options={
+                'unique_together': {('profile', 'game')},
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
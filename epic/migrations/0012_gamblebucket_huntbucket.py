@@ -0,0 +1,144 @@
+# Generated by Django 3.1.3 on 2026-10-18 03:16
+
+from django.db import migrations, models
+from django.db.models import Case, When, Max, Min, Sum, Count, Value
+from django.db.models.functions import Coalesce, TruncHour, TruncMinute
+import django.db.models.deletion
+
+
+RESOLUTIONS = (('m', TruncMinute), ('h', TruncHour))
+
+
+def populate_buckets(apps, schema_editor):
+    Gamble = apps.get_model('epic', 'Gamble')
+    GambleBucket = apps.get_model('epic', 'GambleBucket')
+    Hunt = apps.get_model('epic', 'Hunt')
+    HuntBucket = apps.get_model('epic', 'HuntBucket')
+    outcome_count = lambda outcome: Sum(Case(When(outcome=outcome, then=1), default=0, output_field=models.IntegerField()))
+    gambles = Gamble.objects.filter(profile__isnull=False)
+    hunts = Hunt.objects.filter(profile__isnull=False, target__isnull=False)
+    for resolution, trunc in RESOLUTIONS:
+        totals = (
+            gambles.values('profile_id', 'game', start=trunc('created'))
+            .order_by()
+            .annotate(
+                wins=outcome_count('won'),
+                losses=outcome_count('lost'),
+                ties=outcome_count('tied'),
+                played=Count('id'),
+                total=Sum('net'),
+                most=Max(Case(When(net__gt=0, then='net'), default=0)),
+                least=Min(Case(When(net__lt=0, then='net'), default=0)),
+            )
+        )
+        GambleBucket.objects.bulk_create(
+            (
+                GambleBucket(
+                    profile_id=t['profile_id'],
+                    resolution=resolution,
+                    start=t['start'],
+                    game=t['game'],
+                    wins=t['wins'],
+                    losses=t['losses'],
+                    ties=t['ties'],
+                    count=t['played'],
+                    net=t['total'],
+                    big_win=t['most'],
+                    big_loss=t['least'],
+                )
+                for t in totals
+            ),
+            batch_size=1000,
+        )
+        totals = (
+            hunts.values('profile_id', 'target', start=trunc('created'), item=Coalesce('loot', Value('')))
+            .order_by()
+            .annotate(kills=Count('id'), exp=Coalesce(Sum('xp'), 0))
+        )
+        HuntBucket.objects.bulk_create(
+            (
+                HuntBucket(
+                    profile_id=t['profile_id'],
+                    resolution=resolution,
+                    start=t['start'],
+                    target=t['target'],
+                    loot=t['item'],
+                    hunted=t['kills'],
+                    xp=t['exp'],
+                )
+                for t in totals
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('epic', '0011_gamblerollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GambleBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('m', 'Minute'), ('h', 'Hour')], max_length=1)),
+                ('start', models.DateTimeField()),
+                ('game', models.CharField(choices=[('bj', 'Blackjack'), ('cf', 'Coinflip'), ('slots', 'Slots'), ('dice', 'Dice')], max_length=5)),
+                ('wins', models.PositiveIntegerField(default=0)),
+                ('losses', models.PositiveIntegerField(default=0)),
+                ('ties', models.PositiveIntegerField(default=0)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('net', models.BigIntegerField(default=0)),
+                ('big_win', models.BigIntegerField(default=0)),
+                ('big_loss', models.BigIntegerField(default=0)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gamble_buckets', to='epic.profile')),
+            ],
+            options={
+                'unique_together': {('profile', 'resolution', 'start', 'game')},
+            },
+        ),
+        migrations.CreateModel(
+            name='HuntBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('m', 'Minute'), ('h', 'Hour')], max_length=1)),
+                ('start', models.DateTimeField()),
+                ('target', models.CharField(max_length=50)),
+                ('loot', models.CharField(blank=True, default='', max_length=50)),
+                ('hunted', models.PositiveIntegerField(default=0)),
+                ('xp', models.PositiveBigIntegerField(default=0)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hunt_buckets', to='epic.profile')),
+            ],
+            options={
+                'unique_together': {('profile', 'resolution', 'start', 'target', 'loot')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='gamblebucket',
+            index=models.Index(fields=['resolution', 'start'], name='epic_gamble_resolut_8fa3f0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='huntbucket',
+            index=models.Index(fields=['resolution', 'start'], name='epic_huntbu_resolut_3bec4e_idx'),
+        ),
+        migrations.AlterField(
+            model_name='gamble',
+            name='created',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='hunt',
+            index=models.Index(fields=['created'], name='epic_hunt_created_baf1ed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hunt',
+            index=models.Index(fields=['profile', 'created'], name='epic_hunt_profile_38eecb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gamble',
+            index=models.Index(fields=['profile', 'created'], name='epic_gamble_profile_4ec7fa_idx'),
+        ),
+        migrations.RunPython(populate_buckets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.3 on 2026-10-18 03:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('epic', '0012_gamblebucket_huntbucket'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cooldown',
+            index=models.Index(fields=['after'], name='epic_cooldo_after_3ba1c9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cooldown',
+            index=models.Index(fields=['type', 'after'], name='epic_cooldo_type_31dc7d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='guild',
+            index=models.Index(fields=['after'], name='epic_guild_after_c4b3a0_idx'),
+        ),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+import operator
+
+from django.db import models, connection, transaction
 
 
 class UpdateAble(models.Model):
@@ -9,6 +11,103 @@ class UpdateAble(models.Model):
     updated = models.DateTimeField(auto_now=True)
 
     def update(self, **kwargs):
+        # only the changed columns, the rest of the instance may be an old (cached) copy
         for k, v in kwargs.items():
             setattr(self, k, v)
-        self.save()
+        self.save(update_fields=[*kwargs, "updated"])
+
+
+class Rollup(models.Model):
+    """
+    Running totals over an append-only table, upserted in the same transaction as the rows they
+    summarize. Subclasses name their unique `KEYS` and counters: `SUMS` are added up, `GREATEST`
+    and `LEAST` keep the extremes. `contributions` says what a single row adds and `totals`
+    recomputes everything from `SOURCE`.
+    """
+
+    class Meta:
+        abstract = True
+
+    SOURCE = None
+    KEYS, SUMS, GREATEST, LEAST = (), (), (), ()
+
+    @classmethod
+    def contributions(cls, instance):
+        """Yields `(keys, counters)` for every rollup row `instance` counts towards."""
+        raise NotImplementedError
+
+    @classmethod
+    def totals(cls):
+        """Yields the field values of every rollup row, aggregated from `SOURCE`."""
+        raise NotImplementedError
+
+    @classmethod
+    def deltas(cls, instances):
+        """The combined contributions of a batch, as rows for `upsert_sql`."""
+        sums, greatest = len(cls.SUMS), len(cls.SUMS) + len(cls.GREATEST)
+        rows = {}
+        for instance in instances:
+            for keys, counters in cls.contributions(instance):
+                current = rows.get(keys)
+                if current is not None:
+                    counters = (
+                        *map(operator.add, current[:sums], counters[:sums]),
+                        *map(max, current[sums:greatest], counters[sums:greatest]),
+                        *map(min, current[greatest:], counters[greatest:]),
+                    )
+                rows[keys] = counters
+        return [(*keys, *counters) for keys, counters in rows.items()]
+
+    @classmethod
+    def upsert_sql(cls):
+        qn = connection.ops.quote_name
+        table = qn(cls._meta.db_table)
+        column = lambda name: qn(cls._meta.get_field(name).column)
+        updates = [f"{col} = {table}.{col} + excluded.{col}" for col in map(column, cls.SUMS)]
+        # MAX()/MIN() with two arguments are spelled GREATEST()/LEAST() in Postgres
+        for names, op in ((cls.GREATEST, ">"), (cls.LEAST, "<")):
+            updates.extend(
+                f"{col} = CASE WHEN excluded.{col} {op} {table}.{col} THEN excluded.{col} ELSE {table}.{col} END"
+                for col in map(column, names)
+            )
+        columns = [column(name) for name in (*cls.KEYS, *cls.SUMS, *cls.GREATEST, *cls.LEAST)]
+        return (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON CONFLICT ({', '.join(map(column, cls.KEYS))}) DO UPDATE SET {', '.join(updates)}"
+        )
+
+    @classmethod
+    def apply(cls, instances):
+        rows = cls.deltas(instances)
+        if rows:
+            with connection.cursor() as cursor:
+                cursor.executemany(cls.upsert_sql(), rows)
+
+    @classmethod
+    def rebuild(cls):
+        with transaction.atomic():
+            cls.objects.all().delete()
+            return cls.objects.bulk_create((cls(**values) for values in cls.totals()), batch_size=1000)
+
+
+class TimeBucket(Rollup):
+    """A `Rollup` that is also keyed on the minute and the hour its rows were created in."""
+
+    class Meta:
+        abstract = True
+
+    MINUTE, HOUR = "m", "h"
+    RESOLUTION_CHOICES = (
+        (MINUTE, "Minute"),
+        (HOUR, "Hour"),
+    )
+
+    resolution = models.CharField(choices=RESOLUTION_CHOICES, max_length=1)
+    start = models.DateTimeField()
+
+    @classmethod
+    def starts(cls, created):
+        """The `(resolution, start)` of both buckets `created` falls in, ready to be used as SQL parameters."""
+        adapt = connection.ops.adapt_datetimefield_value
+        minute = created.replace(second=0, microsecond=0)
+        return (cls.MINUTE, adapt(minute)), (cls.HOUR, adapt(minute.replace(minute=0)))
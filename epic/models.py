@@ -3,12 +3,13 @@ import pytz
 import datetime
 import itertools
 
-from asgiref.sync import sync_to_async
-
 from django.db import models
+from django.db.models import Case, When, Max, Min, Sum, Count, Value
+from django.db.models.functions import Coalesce, TruncHour, TruncMinute
 from django.utils import timezone
 
-from .mixins import UpdateAble
+from .db import db_sync_to_async
+from .mixins import UpdateAble, Rollup, TimeBucket
 from .utils import tokenize
 from .managers import ProfileManager, GamblingStatsManager, HuntManager
 
@@ -36,6 +37,9 @@ class Server(models.Model):
 
 
 class Guild(UpdateAble, models.Model):
+    class Meta:
+        indexes = [models.Index(fields=["after"])]
+
     name = models.CharField(max_length=50, primary_key=True)
     after = models.DateTimeField(null=True, blank=True)
     # player has dibbs on the next guild event
@@ -102,6 +106,7 @@ class Profile(UpdateAble, models.Model):
 class CoolDown(models.Model):
     class Meta:
         unique_together = ("profile", "type")
+        indexes = [models.Index(fields=["after"]), models.Index(fields=["type", "after"])]
 
     time_regex = re.compile(
         r"(?P<days>\d{1}d)?\s*(?P<hours>\d{1,2}h)?\s*(?P<minutes>\d{1,2}m)?\s*(?P<seconds>\d{1,2}s)"
@@ -196,6 +201,15 @@ class CoolDown(models.Model):
         "not so mini boss": lambda x: "dungeon" if "join" in x else None,
         "guild": lambda x: "guild" if "raid" in x else None,
     }
+    # resolves the command straight from the raw (lowercased) string, longest names first so "adv" can't shadow
+    # "adventure". multi-word names can only be reached through quoting, so they are left to the shlex fallback.
+    command_regex = re.compile(
+        r"[ \t\r\n]*(?P<cmd>{})(?=[ \t\r\n]|\Z)(?:[ \t\r\n]+(?P<args>.*?))?[ \t\r\n]*\Z".format(
+            "|".join(re.escape(c) for c in sorted(COMMAND_RESOLUTION_MAP, key=len, reverse=True) if " " not in c)
+        ),
+        re.DOTALL,
+    )
+    whitespace_regex = re.compile(r"[ \t\r\n]+")
 
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE)
     type = models.CharField(choices=COOLDOWN_TYPE_CHOICES, max_length=10)
@@ -205,72 +219,53 @@ class CoolDown(models.Model):
         return f"{self.profile} can {self.type} after {self.after}"
 
     @staticmethod
-    def cd_from_command(cmd):
-        resolved = None
-        tokens = tokenize(cmd)
-        if not tokens:
-            return None, None
-        # zero argument commands will just return whether or not the command matched
-        if len(tokens) == 1:
-            resolved = CoolDown.COMMAND_RESOLUTION_MAP.get(tokens[0], lambda x: None)("")
-        else:
+    def resolve_command(cmd):
+        if not cmd:
+            return None
+        cmd = cmd.lower()
+        if "'" in cmd or '"' in cmd or "\\" in cmd:
+            # quoting and escapes need a real lexer
+            tokens = tokenize(cmd)
+            if not tokens:
+                return None
             cmd, *args = tokens
-            # mutli-arguments must be resolved in the basis of other args
-            resolved = CoolDown.COMMAND_RESOLUTION_MAP.get(cmd, lambda x: None)(" ".join(args))
+            return CoolDown.COMMAND_RESOLUTION_MAP.get(cmd, lambda x: None)(" ".join(args))
+        match = CoolDown.command_regex.match(cmd)
+        if not match:
+            return None
+        args = match.group("args")
+        # mutli-arguments must be resolved in the basis of other args
+        args = " ".join(CoolDown.whitespace_regex.split(args)) if args else ""
+        return CoolDown.COMMAND_RESOLUTION_MAP[match.group("cmd")](args)
+
+    @staticmethod
+    def cd_from_command(cmd):
+        resolved = CoolDown.resolve_command(cmd)
         if not resolved:
             return None, None
         return resolved, datetime.datetime.now(tz=datetime.timezone.utc) + CoolDown.COOLDOWN_MAP[resolved]
 
     @staticmethod
     def from_cd(profile, fields):
-        start = datetime.datetime.now(tz=datetime.timezone.utc)
-        cooldown_updates, cooldown_evictions = [], []
-        cd_types = set(c[0] for c in CoolDown.COOLDOWN_TYPE_CHOICES)
-        for field in fields:
-            fields_on_cooldown = CoolDown.on_cooldown_regex.findall(field)
-            fields_off_cooldown = CoolDown.off_cooldown_regex.findall(field)
-            if fields_on_cooldown:
-                time_matches = CoolDown.time_regex.findall(field)
-                for i, field_on_cooldown in enumerate(fields_on_cooldown):
-                    time_delta_params = {
-                        key: int(time_matches[i][j][:-1]) if time_matches[i][j] else 0
-                        for j, key in enumerate(["days", "hours", "minutes", "seconds"])
-                    }
-                    after = start + datetime.timedelta(**time_delta_params)
-                    for cd_type in cd_types:
-                        if cd_type in field_on_cooldown.lower():
-                            cooldown_updates.append(CoolDown(profile=profile, type=cd_type, after=after))
-                            cd_types.remove(cd_type)
-                            break
-                    # special case
-                    if "mine" in field_on_cooldown.lower():
-                        cooldown_updates.append(CoolDown(profile=profile, type="work", after=after))
-            if fields_off_cooldown:
-                for field_off_cooldown in fields_off_cooldown:
-                    for cd_type in cd_types:
-                        if cd_type in field_off_cooldown.lower():
-                            cooldown_evictions.append({"profile": profile, "type": cd_type})
-                            cd_types.remove(cd_type)
-                            break
-                    if "mine" in field_off_cooldown.lower():
-                        cooldown_evictions.append({"profile": profile, "type": "mine"})
-        return cooldown_updates, cooldown_evictions
+        from .parsers import parse_cooldown_list
+
+        updates, evictions = parse_cooldown_list(fields)
+        return (
+            [CoolDown(profile=profile, type=cd.type, after=cd.after) for cd in updates],
+            [{"profile": profile, "type": cd_type} for cd_type in evictions],
+        )
 
     @staticmethod
     def from_cooldown_reponse(profile, title, _type):
-        start = datetime.datetime.now(tz=datetime.timezone.utc)
-        time_match = CoolDown.time_regex.search(title)
-        if time_match:
-            time_match = time_match.groupdict()
-            time_delta_params = {
-                key: int(time_match[key][:-1]) if time_match[key] else 0
-                for key in ["days", "hours", "minutes", "seconds"]
-            }
-            return [CoolDown(profile=profile, type=_type, after=start + datetime.timedelta(**time_delta_params))]
-        return []
+        from .parsers import parse_cooldown_response
+
+        return [CoolDown(profile=profile, type=cd.type, after=cd.after) for cd in parse_cooldown_response(title, _type)]
 
 
 class Gamble(models.Model):
+    class Meta:
+        indexes = [models.Index(fields=["profile", "created"])]
+
     GAME_TYPE_CHOICES = (
         ("bj", "Blackjack"),
         ("cf", "Coinflip"),
@@ -293,7 +288,7 @@ class Gamble(models.Model):
     game = models.CharField(choices=GAME_TYPE_CHOICES, max_length=5)
     outcome = models.CharField(choices=OUTCOME_CHOICES, max_length=4)
     net = models.IntegerField()
-    created = models.DateTimeField(auto_now=True)
+    created = models.DateTimeField(auto_now=True, db_index=True)
 
     objects = GamblingStatsManager()
 
@@ -303,44 +298,131 @@ class Gamble(models.Model):
 
     @staticmethod
     def from_results_screen(profile, embed):
-        game_regex = re.compile(r"(blackjack|dice|slots|coinflip)")
-        game_match = game_regex.search(embed.author.name)
-        if not game_match:
-            return None
-        game = game_match.group(1)
-        "it's a tie lmao"
-        outcome_regex = re.compile(r"(?P<outcome>won|lost) (\*{2})?(?P<amount>[0-9,]+)(\*{2})? coins")
-        gamble = None
-        if game in {"blackjack", "dice", "coinflip"}:
-            for field in embed.fields:
-                name_match, value_match = outcome_regex.search(field.name), outcome_regex.search(field.value)
-                if name_match:
-                    outcome, _, amount, _ = name_match.groups()
-                    amount = amount.replace(",", "")
-                    net = -int(amount) if outcome == "lost" else int(amount)
-                    gamble = Gamble(profile=profile, game=Gamble.GAME_CUE_MAP[game], outcome=outcome, net=net)
-                elif value_match:
-                    outcome, _, amount, _ = value_match.groups()
-                    amount = amount.replace(",", "")
-                    net = -int(amount) if outcome == "lost" else int(amount)
-                    gamble = Gamble(profile=profile, game=Gamble.GAME_CUE_MAP[game], outcome=outcome, net=net)
-                elif "it's a tie lmao" in field.name:
-                    gamble = Gamble(profile=profile, game=Gamble.GAME_CUE_MAP[game], outcome="tied", net=0)
-        elif game == "slots":
-            outcome_match = outcome_regex.search(embed.description)
-            if outcome_match:
-                outcome, _, amount, _ = outcome_match.groups()
-                amount = amount.replace(",", "")
-                net = -int(amount) if outcome == "lost" else int(amount)
-                gamble = Gamble(profile=profile, game=Gamble.GAME_CUE_MAP[game], outcome=outcome, net=net)
-        return gamble
-
-    @sync_to_async
+        from .parsers import parse_gamble
+
+        result = parse_gamble(embed)
+        if result:
+            return Gamble(profile=profile, game=result.game, outcome=result.outcome, net=result.net)
+
+    @db_sync_to_async
     def asave(self, *args, **kwargs):
         return super().save(*args, **kwargs)
 
 
+GAMBLE_TOTALS = {
+    "wins": Sum(Case(When(outcome="won", then=1), default=0, output_field=models.IntegerField())),
+    "losses": Sum(Case(When(outcome="lost", then=1), default=0, output_field=models.IntegerField())),
+    "ties": Sum(Case(When(outcome="tied", then=1), default=0, output_field=models.IntegerField())),
+    "count": Count("id"),
+    "net": Sum("net"),
+    "big_win": Max(Case(When(net__gt=0, then="net"), default=0)),
+    "big_loss": Min(Case(When(net__lt=0, then="net"), default=0)),
+}
+
+
+def gamble_totals(grouped):
+    """Aggregates Gambles grouped with `.values()` into rollup counters."""
+    # aliased so that they don't shadow the Gamble fields they aggregate
+    aliases = {f"_{name}": name for name in GAMBLE_TOTALS}
+    for row in grouped.order_by().annotate(**{alias: GAMBLE_TOTALS[name] for alias, name in aliases.items()}):
+        yield {aliases.get(key, key): value for key, value in row.items()}
+
+
+def gamble_counters(gamble):
+    return (
+        int(gamble.outcome == "won"),
+        int(gamble.outcome == "lost"),
+        int(gamble.outcome == "tied"),
+        1,
+        gamble.net,
+        max(gamble.net, 0),
+        min(gamble.net, 0),
+    )
+
+
+class GambleRollup(Rollup):
+    """
+    Lifetime gambling totals per profile and game. Kept up to date in the same transaction
+    as the Gamble inserts (see `Rollup.apply`), `manage.py rebuild_rollups` recomputes them.
+    """
+
+    class Meta:
+        unique_together = ("profile", "game")
+
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="gamble_rollups")
+    game = models.CharField(choices=Gamble.GAME_TYPE_CHOICES, max_length=5)
+    wins = models.PositiveIntegerField(default=0)
+    losses = models.PositiveIntegerField(default=0)
+    ties = models.PositiveIntegerField(default=0)
+    count = models.PositiveIntegerField(default=0)
+    net = models.BigIntegerField(default=0)
+    # like the stats they replace, 0 if there was no win (or loss)
+    big_win = models.BigIntegerField(default=0)
+    big_loss = models.BigIntegerField(default=0)
+
+    SOURCE = Gamble
+    KEYS = ("profile", "game")
+    SUMS, GREATEST, LEAST = ("wins", "losses", "ties", "count", "net"), ("big_win",), ("big_loss",)
+
+    def __str__(self):
+        return f"{self.profile_id} played {self.game} {self.count} times for {self.net}"
+
+    @classmethod
+    def contributions(cls, gamble):
+        if gamble.profile_id is not None:
+            yield (gamble.profile_id, gamble.game), gamble_counters(gamble)
+
+    @classmethod
+    def totals(cls):
+        return gamble_totals(Gamble.objects.filter(profile__isnull=False).values("profile_id", "game"))
+
+
+class GambleBucket(TimeBucket):
+    """The same totals as `GambleRollup` per minute and per hour, for windowed stats."""
+
+    class Meta:
+        unique_together = ("profile", "resolution", "start", "game")
+        indexes = [models.Index(fields=["resolution", "start"])]
+
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="gamble_buckets")
+    game = models.CharField(choices=Gamble.GAME_TYPE_CHOICES, max_length=5)
+    wins = models.PositiveIntegerField(default=0)
+    losses = models.PositiveIntegerField(default=0)
+    ties = models.PositiveIntegerField(default=0)
+    count = models.PositiveIntegerField(default=0)
+    net = models.BigIntegerField(default=0)
+    big_win = models.BigIntegerField(default=0)
+    big_loss = models.BigIntegerField(default=0)
+
+    SOURCE = Gamble
+    KEYS = ("profile", "resolution", "start", "game")
+    SUMS, GREATEST, LEAST = GambleRollup.SUMS, GambleRollup.GREATEST, GambleRollup.LEAST
+
+    def __str__(self):
+        return (
+            f"{self.profile_id} played {self.game} {self.count} times for {self.net} ({self.resolution} {self.start})"
+        )
+
+    @classmethod
+    def contributions(cls, gamble):
+        if gamble.profile_id is not None:
+            counters = gamble_counters(gamble)
+            for resolution, start in cls.starts(gamble.created):
+                yield (gamble.profile_id, resolution, start, gamble.game), counters
+
+    @classmethod
+    def totals(cls):
+        gambles = Gamble.objects.filter(profile__isnull=False)
+        for resolution, trunc in ((cls.MINUTE, TruncMinute), (cls.HOUR, TruncHour)):
+            for values in gamble_totals(gambles.values("profile_id", "game", start=trunc("created"))):
+                yield {"resolution": resolution, **values}
+
+
 class Hunt(UpdateAble, models.Model):
+    class Meta:
+        # the partial minute at the start of a stats window is read from here
+        indexes = [models.Index(fields=["created"]), models.Index(fields=["profile", "created"])]
+
     profile = models.ForeignKey(Profile, on_delete=models.SET_NULL, null=True, related_name="hunts")
     target = models.CharField(max_length=50, db_index=True, null=True, blank=True)
     money = models.PositiveBigIntegerField(null=True, blank=True)
@@ -355,21 +437,57 @@ class Hunt(UpdateAble, models.Model):
 
     @staticmethod
     def save_hunt_result(message):
-        "got a wolf skin"
-        "got a rare lootbox"
-        "got an <:unicornhorn:545329267425149112> unicorn horn"
-        target_regex = re.compile(r"\*\*(?P<name>[^\*]+)\*\* found and killed a [^\*]+\*\*(?P<target>[^\*]+)\*\*")
-        earnings_regex = re.compile(r"Earned ([0-9,]+) coins and ([0-9,]+) XP")
-        loot_regex = re.compile(r"got an? (\s*<:[^:]+:\d+>\s*)?(?P<loot>[\w ]+)(\s*<:[^:]+:\d+>\s*)?")
-        target_match = target_regex.search(message.content)
-        earnings_match = earnings_regex.search(message.content)
-        loot_match = loot_regex.search(message.content)
-        if target_match and earnings_match:
-            name, target = target_match.group(1), target_match.group(2)
-            money, xp = earnings_match.group(1).replace(",", ""), earnings_match.group(2).replace(",", "")
-            loot = ""
-            if loot_match:
-                loot = loot_match.group(2).strip()
-            return name, target, money, xp, loot
-        else:
-            return
+        from .parsers import parse_hunt
+
+        result = parse_hunt(message.content)
+        if result:
+            return tuple(result)
+
+
+class HuntBucket(TimeBucket):
+    """Hunts per minute and per hour, by target and loot, for windowed hunt and drop stats."""
+
+    class Meta:
+        unique_together = ("profile", "resolution", "start", "target", "loot")
+        indexes = [models.Index(fields=["resolution", "start"])]
+
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="hunt_buckets")
+    target = models.CharField(max_length=50)
+    # "" when nothing dropped
+    loot = models.CharField(max_length=50, blank=True, default="")
+    hunted = models.PositiveIntegerField(default=0)
+    xp = models.PositiveBigIntegerField(default=0)
+
+    SOURCE = Hunt
+    KEYS = ("profile", "resolution", "start", "target", "loot")
+    SUMS = ("hunted", "xp")
+
+    def __str__(self):
+        return f"{self.profile_id} killed {self.hunted} {self.target} ({self.resolution} {self.start})"
+
+    @classmethod
+    def contributions(cls, hunt):
+        # hunts that were never closed don't count
+        if hunt.profile_id is not None and hunt.target is not None:
+            counters = (1, int(hunt.xp or 0))
+            for resolution, start in cls.starts(hunt.created):
+                yield (hunt.profile_id, resolution, start, hunt.target, hunt.loot or ""), counters
+
+    @classmethod
+    def totals(cls):
+        hunts = Hunt.objects.filter(profile__isnull=False, target__isnull=False)
+        for resolution, trunc in ((cls.MINUTE, TruncMinute), (cls.HOUR, TruncHour)):
+            grouped = hunts.values("profile_id", "target", start=trunc("created"), _loot=Coalesce("loot", Value("")))
+            for row in grouped.order_by().annotate(_hunted=Count("id"), _xp=Coalesce(Sum("xp"), 0)):
+                yield {
+                    "resolution": resolution,
+                    "profile_id": row["profile_id"],
+                    "target": row["target"],
+                    "start": row["start"],
+                    "loot": row["_loot"],
+                    "hunted": row["_hunted"],
+                    "xp": row["_xp"],
+                }
+
+
+ROLLUPS = (GambleRollup, GambleBucket, HuntBucket)
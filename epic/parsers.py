@@ -0,0 +1,157 @@
+"""
+Parsers for the EPIC RPG output we track. Every pattern is compiled once at import
+and results come back as small slotted records rather than unsaved model instances,
+callers build models only for what they actually write.
+"""
+
+import re
+import datetime
+
+from .models import CoolDown, Gamble
+
+TIME_UNITS = ("days", "hours", "minutes", "seconds")
+# the order the types are checked in when a field name mentions more than one
+COOLDOWN_TYPES = tuple(c[0] for c in CoolDown.COOLDOWN_TYPE_CHOICES)
+
+time_regex = CoolDown.time_regex
+on_cooldown_regex = CoolDown.on_cooldown_regex
+off_cooldown_regex = CoolDown.off_cooldown_regex
+
+game_regex = re.compile(r"(blackjack|dice|slots|coinflip)")
+# "it's a tie lmao"
+outcome_regex = re.compile(r"(?P<outcome>won|lost) (\*{2})?(?P<amount>[0-9,]+)(\*{2})? coins")
+TIE_CUE = "it's a tie lmao"
+FIELD_GAMES = {"blackjack", "dice", "coinflip"}
+
+# "got a wolf skin"
+# "got a rare lootbox"
+# "got an <:unicornhorn:545329267425149112> unicorn horn"
+target_regex = re.compile(r"\*\*(?P<name>[^\*]+)\*\* found and killed a [^\*]+\*\*(?P<target>[^\*]+)\*\*")
+earnings_regex = re.compile(r"Earned ([0-9,]+) coins and ([0-9,]+) XP")
+loot_regex = re.compile(r"got an? (\s*<:[^:]+:\d+>\s*)?(?P<loot>[\w ]+)(\s*<:[^:]+:\d+>\s*)?")
+
+
+class Record:
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+
+class CooldownResult(Record):
+    __slots__ = ("type", "after")
+
+
+class GambleResult(Record):
+    __slots__ = ("game", "outcome", "net")
+
+
+class HuntResult(Record):
+    __slots__ = ("name", "target", "money", "xp", "loot")
+
+
+def _delta(time_parts):
+    days, hours, minutes, seconds = (int(part[:-1]) if part else 0 for part in time_parts)
+    return datetime.timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
+
+
+def parse_cooldown_list(fields, now=None):
+    """
+    Parse the field values of an `rpg cd` embed. Returns `(updates, evictions)`: a list
+    of `CooldownResult` for everything on cooldown and a list of the types that are ready.
+    """
+    now = now or datetime.datetime.now(tz=datetime.timezone.utc)
+    updates, evictions = [], []
+    # each type is claimed at most once per embed
+    remaining = list(COOLDOWN_TYPES)
+    for field in fields:
+        fields_on_cooldown = on_cooldown_regex.findall(field)
+        if fields_on_cooldown:
+            time_matches = time_regex.findall(field)
+            for i, field_on_cooldown in enumerate(fields_on_cooldown):
+                after = now + _delta(time_matches[i])
+                field_on_cooldown = field_on_cooldown.lower()
+                for cd_type in remaining:
+                    if cd_type in field_on_cooldown:
+                        updates.append(CooldownResult(cd_type, after))
+                        remaining.remove(cd_type)
+                        break
+                # special case
+                if "mine" in field_on_cooldown:
+                    updates.append(CooldownResult("work", after))
+        for field_off_cooldown in off_cooldown_regex.findall(field):
+            field_off_cooldown = field_off_cooldown.lower()
+            for cd_type in remaining:
+                if cd_type in field_off_cooldown:
+                    evictions.append(cd_type)
+                    remaining.remove(cd_type)
+                    break
+            if "mine" in field_off_cooldown:
+                evictions.append("mine")
+    return updates, evictions
+
+
+def parse_cooldown_response(title, cd_type, now=None):
+    """Parse the title of a "you can't do that yet" embed, returns a list with at most one `CooldownResult`."""
+    time_match = time_regex.search(title)
+    if not time_match:
+        return []
+    now = now or datetime.datetime.now(tz=datetime.timezone.utc)
+    return [CooldownResult(cd_type, now + _delta(time_match.group(*TIME_UNITS)))]
+
+
+def _gamble_from_match(game, match):
+    outcome, amount = match.group("outcome", "amount")
+    amount = int(amount.replace(",", ""))
+    return GambleResult(Gamble.GAME_CUE_MAP[game], outcome, -amount if outcome == "lost" else amount)
+
+
+def parse_gamble(embed):
+    """Parse a gambling results embed, returns a `GambleResult` or None."""
+    game_match = game_regex.search(embed.author.name)
+    if not game_match:
+        return None
+    game = game_match.group(1)
+    result = None
+    if game in FIELD_GAMES:
+        # the last field with an outcome wins
+        for field in embed.fields:
+            match = outcome_regex.search(field.name) or outcome_regex.search(field.value)
+            if match:
+                result = _gamble_from_match(game, match)
+            elif TIE_CUE in field.name:
+                result = GambleResult(Gamble.GAME_CUE_MAP[game], "tied", 0)
+    else:
+        match = outcome_regex.search(embed.description)
+        if match:
+            result = _gamble_from_match(game, match)
+    return result
+
+
+def parse_hunt(content):
+    """Parse the content of a hunt message, returns a `HuntResult` or None."""
+    target_match = target_regex.search(content)
+    if not target_match:
+        return None
+    earnings_match = earnings_regex.search(content)
+    if not earnings_match:
+        return None
+    loot_match = loot_regex.search(content)
+    return HuntResult(
+        target_match.group(1),
+        target_match.group(2),
+        earnings_match.group(1).replace(",", ""),
+        earnings_match.group(2).replace(",", ""),
+        loot_match.group(2).strip() if loot_match else "",
+    )
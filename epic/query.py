@@ -1,34 +1,77 @@
 import datetime
-
-from asgiref.sync import sync_to_async
+import operator
+import functools
 
 from django.db.models import Q
-from django.db import transaction
-
-from .models import CoolDown, Profile, Guild, Hunt
+from django.db import transaction, connection
+
+from . import aio
+from .models import CoolDown, Profile, Guild, Server, ROLLUPS
+from .cache import cooldown_views, server_cache, profile_cache, stats_cache, MISSING
+from .db import db_sync_to_async
+from .readiness import readiness
+from .scheduler import scheduler
 from .utils import Enum
 
-
-@sync_to_async
-def upsert_cooldowns(cooldowns):
+# keeps each statement under SQLite's default limit of 999 bound parameters
+UPSERT_BATCH_SIZE = 300
+
+
+def _upsert_cooldowns(cooldowns):
+    # last write wins if a batch has the same cooldown twice
+    rows = {(cooldown.profile_id, cooldown.type): cooldown.after for cooldown in cooldowns}
+    if not rows:
+        return
+    qn, adapt = connection.ops.quote_name, connection.ops.adapt_datetimefield_value
+    profile_col, type_col, after_col = (
+        qn(CoolDown._meta.get_field(name).column) for name in ("profile", "type", "after")
+    )
+    items = list(rows.items())
+    with connection.cursor() as cursor:
+        for i in range(0, len(items), UPSERT_BATCH_SIZE):
+            batch = items[i : i + UPSERT_BATCH_SIZE]
+            params = [param for (profile_id, _type), after in batch for param in (profile_id, _type, adapt(after))]
+            # relies on unique_together = ("profile", "type"); supported by both SQLite >= 3.24 and Postgres
+            cursor.execute(
+                f"INSERT INTO {qn(CoolDown._meta.db_table)} ({profile_col}, {type_col}, {after_col}) "
+                f"VALUES {', '.join(['(%s, %s, %s)'] * len(batch))} "
+                f"ON CONFLICT ({profile_col}, {type_col}) DO UPDATE SET {after_col} = excluded.{after_col}",
+                params,
+            )
+    for (profile_id, _type), after in items:
+        scheduler.schedule(("cooldown", profile_id, _type), after)
+    cooldown_views.invalidate({profile_id for profile_id, _ in rows})
+
+
+def _delete_cooldowns(evictions):
+    types_by_profile = {}
+    for eviction in evictions:
+        profile_id = eviction["profile"].pk if "profile" in eviction else eviction["profile_id"]
+        types_by_profile.setdefault(profile_id, set()).add(eviction["type"])
+    if not types_by_profile:
+        return
     q = Q(id=-1)
-    cooldown_dict = {}
-    # search for existing and update if they already exist
-    for cooldown in cooldowns:
-        cooldown_dict[(cooldown.profile_id, cooldown.type)] = cooldown
-        q |= Q(profile_id=cooldown.profile_id) & Q(type=cooldown.type)
-    for cooldown in CoolDown.objects.filter(q):
-        cooldown.after = cooldown_dict.pop((cooldown.profile_id, cooldown.type)).after
-        cooldown.save()
-    # save left over as new
-    for cooldown in cooldown_dict.values():
-        cooldown.save()
+    for profile_id, types in types_by_profile.items():
+        q |= Q(profile_id=profile_id, type__in=types)
+    CoolDown.objects.filter(q).delete()
+    for profile_id, types in types_by_profile.items():
+        for _type in types:
+            scheduler.cancel(("cooldown", profile_id, _type))
+    cooldown_views.invalidate(types_by_profile)
+
+
+@db_sync_to_async
+@transaction.atomic
+def sync_cooldowns(updates, evictions):
+    """Apply the result of `rpg cd` in one transaction: one upsert and one delete statement."""
+    _upsert_cooldowns(updates)
+    _delete_cooldowns(evictions)
 
 
 DNE_ACTIONS = Enum(["NONE", "RAISE"])
 
 
-@sync_to_async
+@db_sync_to_async
 def get_instance(model_class, on_dne=DNE_ACTIONS.NONE, defaults=None, **kwargs):
     if on_dne not in DNE_ACTIONS:
         raise ValueError(f"on_dne must be one of {DNE_ACTIONS}")
@@ -42,54 +85,88 @@ def get_instance(model_class, on_dne=DNE_ACTIONS.NONE, defaults=None, **kwargs):
         return None
 
 
-@sync_to_async
+@db_sync_to_async
 def update_instance(instance, **kwargs):
     for k, v in kwargs.items():
         setattr(instance, k, v)
-    instance.save()
+    # only the changed columns, the rest of the instance may be an old (cached) copy; auto_now isn't written otherwise
+    auto_now = [f.name for f in instance._meta.concrete_fields if getattr(f, "auto_now", False)]
+    instance.save(update_fields=[*kwargs, *auto_now])
     return instance
 
 
-@sync_to_async
+async def get_server(server_id):
+    """Look up a server through the server cache, remembering unregistered servers as `None`."""
+    server = server_cache.get(server_id)
+    if server is MISSING:
+        server = await (aio.get_server(server_id) if aio.enabled else get_instance(Server, id=server_id))
+        server_cache.set(server_id, server)
+    return server
+
+
+async def get_profile(uid, nickname, server, channel):
+    """Get or create a profile through the profile cache, saving only if its server or channel changed."""
+    profile = profile_cache.get(uid)
+    if profile is None:
+        defaults = {
+            "last_known_nickname": nickname,
+            "server": server,
+            "channel": channel,
+        }
+        if aio.enabled:
+            profile, _ = await aio.get_or_create_profile(uid, defaults)
+            # no post_save from the asyncio path
+            readiness.track(profile)
+        else:
+            profile, _ = await get_instance(Profile, uid=str(uid), defaults=defaults)
+        profile_cache.set(profile)
+    if profile.server_id != server.id or profile.channel != channel:
+        profile = await update_instance(profile, server_id=server.id, channel=channel)
+    return profile
+
+
+@db_sync_to_async
 def query_filter(model_class, **kwargs):
     return model_class.objects.filter(**kwargs)
 
 
-@sync_to_async
-def bulk_delete(model_class, kwargs_list=None, **kwargs):
-    if kwargs_list and kwargs:
-        raise ValueError("bulk_delete accepts either a list of dicts or some kwargs to filter on")
-    q = Q(id=-1)
-    if kwargs_list:
-        for _kwargs in kwargs_list:
-            q |= Q(**_kwargs)
-        return model_class.objects.filter(q).delete()
-    if kwargs:
-        return model_class.objects.filter(**kwargs).delete()
+# a cooldown is only worth a notification if the profile has that cooldown type enabled
+ENABLED_COOLDOWN_Q = functools.reduce(
+    operator.or_,
+    (
+        Q(type=cd_type, **{f"profile__{cd_type}": True})
+        for cd_type, _ in CoolDown.COOLDOWN_TYPE_CHOICES
+        if cd_type != "guild"
+    ),
+)
+
 
+def cooldown_message(uid, cd_type):
+    return f"<@{uid}> {CoolDown.COOLDOWN_TEXT_MAP[cd_type]} (**{cd_type.title()}**)"
 
-@sync_to_async
+
+@db_sync_to_async
 @transaction.atomic
 def get_cooldown_messages():
     now = datetime.datetime.now(tz=datetime.timezone.utc)
-    flavor_map = CoolDown.COOLDOWN_TEXT_MAP
-    messages, cleanup = [], []
+    messages, cleanup, uids = [], [], set()
     # get cooldowns minus special cases
-
-    for cd_type in set(c[0] for c in CoolDown.COOLDOWN_TYPE_CHOICES) - {"guild"}:
-        for _id, channel, uid in (
-            Profile.objects.command_type_enabled(cd_type)
-            .filter(cooldown__after__lte=now, cooldown__type=cd_type)
-            .values_list("cooldown__id", "channel", "uid")
-        ):
-            messages.append((f"<@{uid}> {flavor_map[cd_type]} (**{cd_type.title()}**)", channel))
-            cleanup.append(_id)
-    CoolDown.objects.filter(id__in=cleanup).delete()
-    cleanup.clear()
+    for _id, cd_type, channel, uid in (
+        CoolDown.objects.filter(ENABLED_COOLDOWN_Q, after__lte=now, profile__notify=True, profile__server__active=True)
+        .order_by("after")
+        .values_list("id", "type", "profile__channel", "profile__uid")
+    ):
+        messages.append((cooldown_message(uid, cd_type), channel))
+        cleanup.append(_id)
+        uids.add(uid)
+    if cleanup:
+        # a cooldown renewed since it was read has a new `after` and must survive
+        CoolDown.objects.filter(id__in=cleanup, after__lte=now).delete()
+        cooldown_views.invalidate(uids)
     return messages
 
 
-@sync_to_async
+@db_sync_to_async
 @transaction.atomic
 def get_guild_cooldown_messages():
     now = datetime.datetime.now(tz=datetime.timezone.utc)
@@ -111,41 +188,64 @@ def get_guild_cooldown_messages():
                 messages.append((f"<@{uid}> {flavor_map['guild']} (**Guild**) [YOU HAVE DIBBS!!]", channel))
             else:
                 messages.append((f"<@{uid}> {flavor_map['guild']} (**Guild**)", channel))
+    # cached cd views are left alone: a raid time that has passed and an unknown one both show nothing
     Guild.objects.filter(after__lte=now).update(after=None, raid_dibbs=None)
     return messages
 
 
-@sync_to_async
+@db_sync_to_async
 def cleanup_old_cooldowns():
-    return CoolDown.objects.filter(after__lt=datetime.datetime.now(tz=datetime.timezone.utc)).delete()
+    deleted = CoolDown.objects.filter(after__lt=datetime.datetime.now(tz=datetime.timezone.utc)).delete()
+    cooldown_views.clear()
+    return deleted
 
 
-@sync_to_async
+@db_sync_to_async
 def set_guild_cd(profile, after=None):
     now = datetime.datetime.now(tz=datetime.timezone.utc)
     after = now + CoolDown.COOLDOWN_MAP["guild"] if not after else after
-    Guild.objects.filter(profile__uid=profile.uid).update(after=after)
+    guilds = Guild.objects.filter(profile__uid=profile.uid)
+    names = list(guilds.values_list("name", flat=True))
+    for name in names:
+        scheduler.schedule(("guild", name), after)
+    guilds.update(after=after)
+    cooldown_views.invalidate_guild(names)
+
+
+@db_sync_to_async
+def load_scheduler():
+    scheduler.load()
+
 
+@db_sync_to_async
+def load_server_cache():
+    server_cache.load()
 
-@sync_to_async
+
+@db_sync_to_async
+def load_readiness():
+    readiness.load()
+
+
+@db_sync_to_async
+@transaction.atomic
 def set_guild_membership(guild_membership_dict):
+    Guild.objects.bulk_create([Guild(name=guild_name) for guild_name in guild_membership_dict], ignore_conflicts=True)
     for guild_name, member_id_list in guild_membership_dict.items():
-        guild, _ = Guild.objects.get_or_create(name=guild_name)
-        Profile.objects.filter(uid__in=member_id_list).update(player_guild=guild)
+        Profile.objects.filter(uid__in=member_id_list).update(player_guild_id=guild_name)
+        # not before the commit, or another thread could cache the old guild again
+        profile_cache.invalidate(member_id_list)
+        cooldown_views.invalidate(member_id_list)
 
 
-@sync_to_async
+@db_sync_to_async
 @transaction.atomic
-def update_hunt_results(hunt_result, possible_userids):
-    now = datetime.datetime.now(tz=datetime.timezone.utc)
-    expiration = now - datetime.timedelta(seconds=10)
-    target, money, xp, loot = hunt_result
-    # delete open hunts that have expired
-    Hunt.objects.open_hunts(possible_userids).filter(created__lt=expiration).delete()
-    if possible_userids:
-        open_hunts = Hunt.objects.open_hunts(possible_userids)
-        # just have to do best effort in the
-        # case of nickname collision
-        open_hunt = open_hunts.first()
-        if open_hunt:
-            open_hunt.update(target=target, money=money, xp=xp, loot=loot)
+def insert_events(instances):
+    by_model = {}
+    for instance in instances:
+        by_model.setdefault(type(instance), []).append(instance)
+    for model_class, objs in by_model.items():
+        model_class.objects.bulk_create(objs)
+    for rollup in ROLLUPS:
+        rollup.apply(by_model.get(rollup.SOURCE, []))
+    stats_cache.invalidate(instances)
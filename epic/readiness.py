@@ -0,0 +1,97 @@
+import datetime
+import threading
+
+from django.db.models.signals import post_save, post_delete
+
+from .models import CoolDown, Profile
+
+
+class ReadinessIndex:
+    """
+    Who in each server is off cooldown for each cooldown type, kept in memory so that
+    `rcd whocan` doesn't have to anti-join the CoolDown table. A server's profiles are
+    ready for a type unless they hold a cooldown of that type that hasn't expired yet.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # uid -> server id and server id -> uids
+        self._servers = {}
+        self._members = {}
+        # uid -> {type: after} and (server id, type) -> {uid: after}
+        self._cooldowns = {}
+        self._busy = {}
+
+    def load(self):
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        with self._lock:
+            self._servers, self._members, self._cooldowns, self._busy = {}, {}, {}, {}
+            for uid, server_id in Profile.objects.values_list("uid", "server_id"):
+                self._track(uid, server_id)
+            for uid, cooldown_type, after in CoolDown.objects.filter(after__gt=now).values_list(
+                "profile_id", "type", "after"
+            ):
+                self._set(uid, cooldown_type, after)
+
+    def track(self, profile):
+        """Remember which server a profile belongs to, moving its cooldowns along if it changed."""
+        with self._lock:
+            self._track(str(profile.uid), profile.server_id)
+
+    def forget(self, uid):
+        uid = str(uid)
+        with self._lock:
+            server_id = self._servers.pop(uid, None)
+            self._members.get(server_id, set()).discard(uid)
+            for cooldown_type in self._cooldowns.pop(uid, {}):
+                self._busy.get((server_id, cooldown_type), {}).pop(uid, None)
+
+    def set(self, uid, cooldown_type, after):
+        """Record a cooldown, `after=None` means it was evicted."""
+        with self._lock:
+            self._set(str(uid), cooldown_type, after)
+
+    def ready(self, server_id, cooldown_type, now=None):
+        now = now or datetime.datetime.now(tz=datetime.timezone.utc)
+        with self._lock:
+            busy = self._busy.get((server_id, cooldown_type), {})
+            for uid in [uid for uid, after in busy.items() if after <= now]:
+                del busy[uid]
+                self._cooldowns.get(uid, {}).pop(cooldown_type, None)
+            return self._members.get(server_id, set()) - busy.keys()
+
+    def _track(self, uid, server_id):
+        old_server_id = self._servers.get(uid)
+        if old_server_id == server_id:
+            return
+        self._servers[uid] = server_id
+        self._members.setdefault(server_id, set()).add(uid)
+        if old_server_id is not None:
+            self._members[old_server_id].discard(uid)
+        for cooldown_type, after in self._cooldowns.get(uid, {}).items():
+            self._busy.get((old_server_id, cooldown_type), {}).pop(uid, None)
+            self._busy.setdefault((server_id, cooldown_type), {})[uid] = after
+
+    def _set(self, uid, cooldown_type, after):
+        server_id = self._servers.get(uid)
+        if after is None:
+            self._cooldowns.get(uid, {}).pop(cooldown_type, None)
+            self._busy.get((server_id, cooldown_type), {}).pop(uid, None)
+        else:
+            self._cooldowns.setdefault(uid, {})[cooldown_type] = after
+            self._busy.setdefault((server_id, cooldown_type), {})[uid] = after
+
+
+readiness = ReadinessIndex()
+
+
+def _profile_saved(sender, instance, **kwargs):
+    readiness.track(instance)
+
+
+def _profile_deleted(sender, instance, **kwargs):
+    readiness.forget(instance.uid)
+
+
+post_save.connect(_profile_saved, sender=Profile)
+post_delete.connect(_profile_deleted, sender=Profile)
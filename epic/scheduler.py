@@ -0,0 +1,105 @@
+import heapq
+import asyncio
+import datetime
+import threading
+
+
+class DeadlineScheduler:
+    """
+    Min-heap of the next time each cooldown or guild raid comes due. The notifier
+    sleeps until the earliest deadline instead of polling the database.
+    Keys are `("cooldown", profile_id, type)` or `("guild", name)`.
+    """
+
+    # rebuild the heap from _deadlines once stale entries outnumber live ones this many times over
+    COMPACT_FACTOR, COMPACT_MIN = 2, 1024
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+
+    def load(self):
+        from .models import CoolDown, Guild
+
+        with self._lock:
+            self._heap.clear()
+            self._deadlines.clear()
+            for profile_id, cd_type, after in CoolDown.objects.values_list("profile_id", "type", "after"):
+                self._push(("cooldown", profile_id, cd_type), after)
+            for name, after in Guild.objects.filter(after__isnull=False).values_list("name", "after"):
+                self._push(("guild", name), after)
+        self._wake()
+
+    def schedule(self, key, after):
+        with self._lock:
+            if self._deadlines.get(key) == after:
+                return
+            self._push(key, after)
+            earliest = self._heap[0][0] == after
+        if earliest:
+            self._wake()
+
+    def retry(self, keys, after):
+        """Schedule popped `keys` again at `after`, unless they have been scheduled again in the meantime."""
+        with self._lock:
+            for key in keys:
+                if key not in self._deadlines:
+                    self._push(key, after)
+        self._wake()
+
+    def cancel(self, key):
+        # heap entries are discarded lazily once they no longer match _deadlines
+        with self._lock:
+            self._deadlines.pop(key, None)
+
+    def pop_due(self, now=None):
+        now = now or datetime.datetime.now(tz=datetime.timezone.utc)
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                after, key = heapq.heappop(self._heap)
+                if self._deadlines.get(key) == after:
+                    del self._deadlines[key]
+                    due.append(key)
+        return due
+
+    def next_deadline(self):
+        with self._lock:
+            while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    async def wait(self):
+        """Sleep until the next deadline or until an earlier one is scheduled."""
+        if self._wakeup is None:
+            self._loop, self._wakeup = asyncio.get_running_loop(), asyncio.Event()
+        self._wakeup.clear()
+        deadline = self.next_deadline()
+        timeout = None
+        if deadline is not None:
+            timeout = (deadline - datetime.datetime.now(tz=datetime.timezone.utc)).total_seconds()
+            if timeout <= 0:
+                return
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _push(self, key, after):
+        self._deadlines[key] = after
+        heapq.heappush(self._heap, (after, key))
+        # rescheduling leaves the old entry behind until it reaches the top, which can take days
+        if len(self._heap) > (self.COMPACT_FACTOR + 1) * len(self._deadlines) + self.COMPACT_MIN:
+            self._heap = [(after, key) for key, after in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def _wake(self):
+        # writes happen on the database threads, so hop back onto the loop
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+
+scheduler = DeadlineScheduler()
@@ -1,5 +1,7 @@
 import re
+import pytz
 import shlex
+import functools
 
 
 class Enum(set):
@@ -15,3 +17,8 @@ def tokenize(cmd, preserve_case=False):
     if not preserve_case:
         cmd = cmd.lower()
     return shlex.split(cmd)
+
+
+@functools.lru_cache(maxsize=None)
+def get_timezone(name):
+    return pytz.timezone(name)
@@ -32,6 +32,11 @@ environment_defaults = {
     "DATABASE_HOST": "127.0.0.1",
     "DATABASE_PORT": "5432",
     "DISCORD_TOKEN": "TOKEN",
+    "CONN_MAX_AGE": "600",
+    "DB_WORKERS": "4",
+    "DB_SLOW_WORKERS": "1",
+    "ASYNC_DB": "0",
+    "SQLITE_TUNED": "1",
 }
 
 ENV = utils.get_runtime_parameters(environment_defaults)
@@ -49,6 +54,14 @@ DATABASE_PASSWORD = ENV.DATABASE_PASSWORD
 DATABASE_HOST = ENV.DATABASE_HOST
 DATABASE_PORT = ENV.DATABASE_PORT
 DISCORD_TOKEN = ENV.DISCORD_TOKEN
+CONN_MAX_AGE = int(ENV.CONN_MAX_AGE)
+# threads the bot uses for ORM work, see epic/db.py
+DB_WORKERS = int(ENV.DB_WORKERS)
+DB_SLOW_WORKERS = int(ENV.DB_SLOW_WORKERS)
+# use aiosqlite/asyncpg for the bot's hot queries, see epic/aio.py
+ASYNC_DB = ENV.ASYNC_DB
+# WAL and the other pragmas in epic/db.py, and BEGIN IMMEDIATE transactions (epic/backends/sqlite3)
+SQLITE_TUNED = ENV.SQLITE_TUNED
 
 
 # Quick-start development settings - unsuitable for production
@@ -111,8 +124,10 @@ WSGI_APPLICATION = "epic_reminder.wsgi.application"
 if ENV.USE_SQLITE:
     DATABASES = {
         "default": {
-            "ENGINE": "django.db.backends.sqlite3",
+            # django.db.backends.sqlite3 that begins transactions with IMMEDIATE when SQLITE_TUNED
+            "ENGINE": "epic.backends.sqlite3",
             "NAME": os.path.join(BASE_DIR, f"{ENV.DATABASE_NAME}.sqlite3"),
+            "CONN_MAX_AGE": CONN_MAX_AGE,
         }
     }
 else:
@@ -125,6 +140,7 @@ else:
             "PASSWORD": ENV.DATABASE_PASSWORD,
             "HOST": DATABASE_HOST,
             "PORT": ENV.DATABASE_PORT,
+            "CONN_MAX_AGE": CONN_MAX_AGE,
         }
     }
 
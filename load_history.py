@@ -65,7 +65,10 @@ def gambling(file_name="message_dump.json"):
                             gamble = Gamble.from_results_screen(profile, embed)
                             if gamble:
                                 gambles.append(gamble)
-    Gamble.objects.bulk_create(gambles)
+    with transaction.atomic():
+        Gamble.objects.bulk_create(gambles)
+        GambleRollup.apply(gambles)
+        GambleBucket.apply(gambles)
 
 
 def hunt(file_name="message_dump.json"):
@@ -83,7 +86,9 @@ def hunt(file_name="message_dump.json"):
                 if hunt_result:
                     name, target, money, xp, loot = hunt_result
                     hunts.append(Hunt(profile=all_profiles[name], target=target, money=money, xp=xp, loot=loot))
-    Hunt.objects.bulk_create(hunts)
+    with transaction.atomic():
+        Hunt.objects.bulk_create(hunts)
+        HuntBucket.apply(hunts)
 
 
 if __name__ == "__main__":
@@ -100,7 +105,8 @@ if __name__ == "__main__":
     get_wsgi_application()
 
     from django.conf import settings
-    from epic.models import Gamble, Server, Profile, Hunt
+    from django.db import transaction
+    from epic.models import Gamble, GambleRollup, GambleBucket, Server, Profile, Hunt, HuntBucket
 
     fire.Fire(
         {
@@ -1,6 +1,7 @@
 import os
-import re
 import asyncio
+import logging
+import datetime
 import dotenv
 import discord
 
@@ -13,78 +14,113 @@ from django.core.wsgi import get_wsgi_application
 
 get_wsgi_application()
 
-from epic.models import CoolDown, Profile, Server, JoinCode, Gamble, Hunt
+from epic.models import CoolDown, Profile, Server, JoinCode, Gamble
 from epic.query import (
-    get_instance,
-    update_instance,
-    upsert_cooldowns,
-    bulk_delete,
+    get_server,
+    get_profile,
     get_cooldown_messages,
     get_guild_cooldown_messages,
     set_guild_cd,
     set_guild_membership,
-    update_hunt_results,
+    load_scheduler,
+    load_server_cache,
+    load_readiness,
 )
+from epic import aio
+from epic.buffers import cooldown_buffer, event_buffer
+from epic.classify import classify, guild_roster_regex, roster_player_regex, MESSAGE_KINDS
+from epic.members import member_index
+from epic.parsers import parse_cooldown_list, parse_cooldown_response, parse_gamble, parse_hunt
+from epic.scheduler import scheduler
+from epic.delivery import ChannelResolver, coalesce, outbox, COALESCE_WINDOW
 from epic.utils import tokenize
 
 from epic.cmd_chain import handle_rpcd_message
 from epic.scrape import log_message
 
+log = logging.getLogger("epic.notifier")
+# seconds before retrying reminders after a failed notifier run, doubling up to the maximum
+RETRY_BACKOFF, MAX_RETRY_BACKOFF = 1, 60
+
 
 async def process_rpg_messages(client, server, message):
-    rpg_cd_rd_cues, cooldown_cue = ["cooldowns", "ready"], "cooldown"
-    gambling_cues = set(Gamble.GAME_CUE_MAP.keys())
-    cues = [*rpg_cd_rd_cues, *gambling_cues, cooldown_cue]
-    if "found and killed" in message.content:
-        hunt_result = Hunt.save_hunt_result(message)
-        if hunt_result:
-            name, *other = hunt_result
-            possible_userids = [str(m.id) for m in client.get_all_members() if name == m.name]
-            return await update_hunt_results(other, possible_userids)
-    for embed in message.embeds:
-        if getattr(embed.author, "name", None) and any([cue in embed.author.name for cue in cues]):
-            # the user mentioned
-            user_id = embed.author.icon_url.strip("https://cdn.discordapp.com/avatars/").split("/")[0]
-            user = client.get_user(int(user_id))
-            profile, _ = await get_instance(
-                Profile,
-                uid=user_id,
-                defaults={
-                    "last_known_nickname": user.name,
-                    "server": server,
-                    "channel": message.channel.id,
-                },
-            )
-            if profile.server_id != server.id or profile.channel != message.channel.id:
-                profile = await update_instance(profile, server_id=server.id, channel=message.channel.id)
-            # is the cooldowns list
-            if any([cue in embed.author.name for cue in rpg_cd_rd_cues]):
-                update, delete = CoolDown.from_cd(profile, [field.value for field in embed.fields])
-                await upsert_cooldowns(update)
-                await bulk_delete(CoolDown, delete)
-            elif cooldown_cue in embed.author.name:
-                for cue, cooldown_type in CoolDown.COOLDOWN_RESPONSE_CUE_MAP.items():
-                    if cue in str(embed.title):
-                        cooldowns = CoolDown.from_cooldown_reponse(profile, embed.title, cooldown_type)
-                        if cooldowns and cooldown_type == "guild":
-                            return await set_guild_cd(profile, cooldowns[0].after)
-                        await upsert_cooldowns(cooldowns)
-            elif any([cue in embed.author.name for cue in gambling_cues]):
-                gamble = Gamble.from_results_screen(profile, embed)
-                if gamble:
-                    await gamble.asave()
-    return
+    kind, embed = classify(message)
+    if kind in {MESSAGE_KINDS.IGNORE, MESSAGE_KINDS.GUILD_ROSTER}:
+        # guild rosters are only handled once they are edited in, see on_message_edit
+        return
+    if kind == MESSAGE_KINDS.HUNT:
+        hunt = parse_hunt(message.content)
+        if hunt:
+            possible_userids = [str(user_id) for user_id in member_index.ids_by_name(message.guild.id, hunt.name)]
+            event_buffer.close_hunt(possible_userids, hunt.target, hunt.money, hunt.xp, hunt.loot)
+        return
+    # the user mentioned
+    user_id = embed.author.icon_url.strip("https://cdn.discordapp.com/avatars/").split("/")[0]
+    user = client.get_user(int(user_id))
+    profile = await get_profile(user_id, user.name, server, message.channel.id)
+    if kind == MESSAGE_KINDS.COOLDOWN_LIST:
+        updates, evictions = parse_cooldown_list([field.value for field in embed.fields])
+        for cooldown in updates:
+            cooldown_buffer.put(profile.uid, cooldown.type, cooldown.after)
+        for cooldown_type in evictions:
+            cooldown_buffer.evict(profile.uid, cooldown_type)
+    elif kind == MESSAGE_KINDS.COOLDOWN_RESPONSE:
+        for cue, cooldown_type in CoolDown.COOLDOWN_RESPONSE_CUE_MAP.items():
+            if cue in str(embed.title):
+                cooldowns = parse_cooldown_response(embed.title, cooldown_type)
+                if cooldowns and cooldown_type == "guild":
+                    return await set_guild_cd(profile, cooldowns[0].after)
+                for cooldown in cooldowns:
+                    cooldown_buffer.put(profile.uid, cooldown.type, cooldown.after)
+    elif kind == MESSAGE_KINDS.GAMBLE:
+        gamble = parse_gamble(embed)
+        if gamble:
+            event_buffer.put(Gamble(profile=profile, game=gamble.game, outcome=gamble.outcome, net=gamble.net))
 
 
 class Client(discord.Client):
     async def on_ready(self):
+        await load_server_cache()
+        await load_readiness()
+        member_index.build(self.guilds)
         print("Logged on as {0}!".format(self.user))
 
+    async def on_guild_join(self, guild):
+        member_index.add_guild(guild)
+
+    async def on_guild_remove(self, guild):
+        member_index.remove_guild(guild)
+
+    async def on_member_join(self, member):
+        member_index.add(member)
+
+    async def on_member_update(self, before, after):
+        member_index.add(after)
+
+    async def on_member_remove(self, member):
+        member_index.remove(member)
+
+    async def on_user_update(self, before, after):
+        member_index.rename(after)
+
+    async def close(self):
+        # don't lose anything that is still waiting to be written, but shut down even if the database is unavailable
+        for buffer in (cooldown_buffer, event_buffer):
+            try:
+                await buffer.flush()
+            except Exception:
+                log.exception("Flushing %s on shutdown failed, %s writes lost", type(buffer).__name__, buffer.depth())
+        try:
+            await aio.close()
+        except Exception:
+            log.exception("Closing the asyncio database connection failed")
+        await super().close()
+
     async def on_message(self, message):
         if message.author == self.user:
             return
 
-        server = await get_instance(Server, id=message.channel.guild.id)
+        server = await get_server(message.channel.guild.id)
         if server and not server.active:
             return
 
@@ -102,9 +138,8 @@ class Client(discord.Client):
                     return await logger.shutdown()
             else:
                 tokens = tokenize(message.content[5:])
-            msg = await handle_rpcd_message(self, tokens, message, server, None, None)
-            embed = msg.to_embed()
-            await message.channel.send(embed=embed)
+            msg = await handle_rpcd_message(self, tokens, message, server)
+            outbox.submit(message.channel, priority=outbox.REPLY, embed=msg.to_embed())
 
         if not server:
             return
@@ -117,45 +152,29 @@ class Client(discord.Client):
             cooldown_type, after = CoolDown.cd_from_command(message.content[3:])
             if not cooldown_type:
                 return
-            profile, _ = await get_instance(
-                Profile,
-                uid=message.author.id,
-                defaults={
-                    "last_known_nickname": message.author.name,
-                    "server": server,
-                    "channel": message.channel.id,
-                },
-            )
-            if profile.server_id != server.id or profile.channel != message.channel.id:
-                profile = await update_instance(profile, server_id=server.id, channel=message.channel.id)
+            profile = await get_profile(message.author.id, message.author.name, server, message.channel.id)
             if cooldown_type == "guild":
                 return await set_guild_cd(profile)
             elif cooldown_type in {"hunt", "adventure"}:
-                _, _ = await get_instance(Hunt, profile_id=profile.uid, target=None, defaults={"target": None})
-            await upsert_cooldowns([CoolDown(profile=profile, type=cooldown_type, after=after)])
+                event_buffer.open_hunt(profile.uid)
+            cooldown_buffer.put(profile.uid, cooldown_type, after)
 
     async def on_message_edit(self, before, after):
-        guild_name_regex = re.compile(r"\*\*(?P<guild_name>[^\*]+)\*\* members")
-        player_name_regex = re.compile(r"\*\*(?P<player_name>[^\*]+)\*\*")
-        guild_membership = {}
-        guild_id_map = {}
-        for embed in after.embeds:
-            for field in embed.fields:
-                name_match = guild_name_regex.match(field.name)
-                if name_match:
-                    guild_membership[name_match.group(1)] = player_name_regex.findall(field.value)
-                break
-            break
-        for guild, membership_set in guild_membership.items():
-            guild_id_map[guild] = []
-            for member in membership_set:
-                # careful in case name contains multiple #
-                split_name = member.split("#")
-                name, discriminator = "#".join(split_name[:-1]), split_name[-1]
-                user = discord.utils.get(self.get_all_members(), name=name, discriminator=discriminator)
-                if user:
-                    guild_id_map[guild].append(user.id)
-        await set_guild_membership(guild_id_map)
+        kind, embed = classify(after)
+        if kind != MESSAGE_KINDS.GUILD_ROSTER:
+            return
+        # only the first field lists the members
+        field = embed.fields[0]
+        guild_name = guild_roster_regex.match(field.name).group("guild_name")
+        member_ids = []
+        for member in roster_player_regex.findall(field.value):
+            # careful in case name contains multiple #
+            name, _, discriminator = member.rpartition("#")
+            user_id = member_index.id_by_tag(name, discriminator)
+            if user_id:
+                member_ids.append(user_id)
+        if member_ids:
+            await set_guild_membership({guild_name: member_ids})
 
 
 if __name__ == "__main__":
@@ -168,15 +187,38 @@ if __name__ == "__main__":
 
     async def notify():
         await bot.wait_until_ready()
+        await load_scheduler()
+        channels = ChannelResolver(bot)
+        backoff = RETRY_BACKOFF
         while not bot.is_closed():
-            cooldown_messages = [
-                *await get_cooldown_messages(),
-                *await get_guild_cooldown_messages(),
-            ]
-            for message, channel in cooldown_messages:
-                _channel = await bot.fetch_channel(channel)
-                await _channel.send(message)
-            await asyncio.sleep(5)  # task runs every 5 seconds
+            # sleeps until the next cooldown is due or an earlier one gets scheduled
+            await scheduler.wait()
+            # give reminders that are due at nearly the same time a chance to share a message
+            await asyncio.sleep(COALESCE_WINDOW)
+            due = scheduler.pop_due()
+            try:
+                await send_reminders(channels, {key[0] for key in due})
+                backoff = RETRY_BACKOFF
+            except Exception:
+                log.exception("Sending reminders failed, retrying in %ss", backoff)
+                retry_at = datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(seconds=backoff)
+                scheduler.retry(due, retry_at)
+                backoff = min(backoff * 2, MAX_RETRY_BACKOFF)
+
+    async def send_reminders(channels, due_kinds):
+        cooldown_messages = []
+        if "cooldown" in due_kinds:
+            cooldown_messages.extend(await (aio.get_cooldown_messages() if aio.enabled else get_cooldown_messages()))
+        if "guild" in due_kinds:
+            cooldown_messages.extend(await get_guild_cooldown_messages())
+        for channel_id, messages in coalesce(cooldown_messages).items():
+            channel = await channels.get(channel_id)
+            if channel is None:
+                continue
+            for message in messages:
+                outbox.submit(channel, priority=outbox.REMINDER, content=message)
 
     bot.loop.create_task(notify())
+    bot.loop.create_task(cooldown_buffer.run())
+    bot.loop.create_task(event_buffer.run())
     bot.run(settings.DISCORD_TOKEN)